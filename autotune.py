@@ -0,0 +1,124 @@
+import argparse
+import os
+import time
+import numpy as np
+import torch
+import yaml
+
+from .detect import Detect
+from .data_loader import sample_frames
+from .config_parser import get_config
+from .storage import global_var
+
+def candidates(config,workers):
+    """backend, batch size and thread combinations to benchmark
+
+    Args:
+        config (ParseConfig): ParseConfig Object
+        workers (int): number of detector processes sharing the cores
+
+    Returns:
+        candidates (list): list of dicts with backend, backend_weights, trace_cache, max_batch_size and threads
+    """
+    weights = config.detector_weights_file
+    backends = [("PYTORCH", weights, False), ("TORCHSCRIPT", weights, True)]
+    try:
+        import onnxruntime  # noqa: F401
+        from .export import export_onnx
+        onnx = os.path.splitext(weights)[0] + ".onnx"
+        if not os.path.exists(onnx):
+            export_onnx(weights, onnx, config.img_size)
+        backends.append(("ONNX", onnx, False))
+    except ImportError:
+        print("onnxruntime is not installed, skipping ONNX")
+    openvino = os.path.splitext(weights)[0] + "_openvino_model"
+    if os.path.exists(openvino):
+        backends.append(("OPENVINO", openvino, False))
+    streams = len(config.arms)
+    batch_sizes = sorted({1, streams} | {size for size in (2, 4, 8, 16) if size < streams})
+    cores = max(1, (os.cpu_count() or 1) // workers)
+    threads = sorted({max(1, cores // 4), max(1, cores // 2), cores})
+    return [{"backend": "PYTORCH" if backend == "TORCHSCRIPT" else backend, "name": backend, "backend_weights": path, "trace_cache": trace,
+             "max_batch_size": batch_size, "threads": thread} for backend,path,trace in backends for batch_size in batch_sizes for thread in threads]
+
+def load_frames(config,count):
+    """
+    Returns:
+        frames (list): frames of the EMULATOR videos, random frames when there are none
+    """
+    try:
+        return sample_frames(config,count)
+    except (OSError, ValueError):
+        return [np.random.randint(0, 255, (config.img_size, config.img_size, 3), dtype=np.uint8) for _ in range(count)]
+
+def benchmark(configfile,candidate,frames,iterations):
+    """times the detection of one batch with the candidate settings
+
+    Args:
+        configfile (str): path to config file
+        candidate (dict): settings to benchmark
+        frames (list): frames to batch
+        iterations (int): number of timed batches
+
+    Returns:
+        latency (list): seconds per batch
+    """
+    config = get_config(global_var,configfile)
+    config.backend = candidate["backend"]
+    config.backend_weights = candidate["backend_weights"]
+    config.trace_cache = candidate["trace_cache"]
+    config.max_batch_size = candidate["max_batch_size"]
+    config.backend_options["intra_op_threads"] = candidate["threads"]
+    torch.set_num_threads(candidate["threads"])
+    detector = Detect(configfile)
+    batch = [frames[ind % len(frames)] for ind in range(candidate["max_batch_size"])]
+    for _ in range(3):
+        detector.detect(batch)
+    latency = []
+    for _ in range(iterations):
+        t1 = time.time()
+        detector.detect(batch)
+        latency.append(time.time() - t1)
+    return latency
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks detector backends, batch sizes and threads and writes the fastest within the latency budget to a tuning file")
+    parser.add_argument('--config', default="configfile.ini", help="path to config file")
+    parser.add_argument('--budget', type=float, default=0.2, help="maximum 95th percentile latency of a batch in seconds")
+    parser.add_argument('--iterations', type=int, default=20, help="number of timed batches per candidate")
+    parser.add_argument('--output', default="tuning.yaml", help="tuning file, set it as TUNING in the DETECTOR section")
+    opt = parser.parse_args()
+    config = get_config(global_var,opt.config)
+    config.tuning_file = ""  # benchmark the candidates, not a previous tuning
+    config.pipeline = False
+    workers = max(1, min(config.detector_workers, len(config.arms)))
+    frames = load_frames(config,16)
+    results = []
+    print("%-12s %6s %8s %12s %12s %10s" % ("backend", "batch", "threads", "mean(ms)", "p95(ms)", "frames/s"))
+    for candidate in candidates(config,workers):
+        try:
+            latency = benchmark(opt.config,candidate,frames,opt.iterations)
+        except Exception as err:
+            print("%-12s %6d %8d skipped: %s" % (candidate["name"], candidate["max_batch_size"], candidate["threads"], err))
+            continue
+        mean, p95 = float(np.mean(latency)), float(np.percentile(latency, 95))
+        results.append((candidate, mean, p95, candidate["max_batch_size"] / mean))
+        print("%-12s %6d %8d %12.1f %12.1f %10.1f" % (candidate["name"], candidate["max_batch_size"], candidate["threads"], mean * 1000, p95 * 1000, results[-1][3]))
+    if not results:
+        raise RuntimeError("No candidate could be benchmarked")
+    within = [result for result in results if result[2] <= opt.budget]
+    if within:
+        best = max(within, key=lambda result: result[3])
+    else:
+        best = min(results, key=lambda result: result[2])
+        print("No candidate meets the %.3fs budget, using the lowest latency" % opt.budget)
+    candidate, mean, p95, fps = best
+    tuning = {k: v for k,v in candidate.items() if k != "name"}
+    tuning.update({"latency": round(mean, 4), "p95_latency": round(p95, 4), "fps": round(fps, 1), "budget": opt.budget,
+                   "cpu_count": os.cpu_count(), "workers": workers, "streams": len(config.arms), "device": str(config.device)})
+    with open(opt.output, "w") as f:
+        yaml.safe_dump(tuning, f, sort_keys=False)
+    print("%s: %s batch %d with %d threads, %.1f frames/s. Set TUNING = %s in the DETECTOR section" % (opt.output, candidate["name"], candidate["max_batch_size"], candidate["threads"], fps, opt.output))
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from configparser import ConfigParser
 import logging
+import os
 
 class ParseConfig:
     """
@@ -17,12 +18,41 @@ class ParseConfig:
         device(int): device to run the Machine Learning model.ie., GPU or CPU
         check_freq(int): frequency to check if all the threads are alive
         debug(bool): debug flag, cv2 window
+        shared_memory(bool): send frames to the detector through shared memory rings instead of pickling them
+        ring_slots(int): number of frame slots in each shared memory ring
+        frame_format(str): format of the frames sent to the detector, BGR or I420 at half the bytes
+        trace_cache(bool): load the PyTorch detector and the deep sort encoder from cached TorchScript traces
+        trace_cache_dir(str): folder of the cached TorchScript traces
         model(str): real or emulator flag
         detector_model(str): type of object detection model
         detector_weight_file(str): path to weights of object detection model
+        backend(str): inference backend of the object detection model, PYTORCH, ONNX or OPENVINO
+        backend_weights(str): path to the exported model of the backend
+        backend_options(dict): intra_op_threads, inter_op_threads, execution_mode, graph_optimization and io_buffers of the ONNX Runtime or OpenVINO backend
+        tuning_file(str): path to the detector settings written by autotune, empty to use the config
+        remote(tuple): (host, port) of a detector service the streams send their frames to, None to run the detector locally
+        service_host(str): address the detector service binds
+        service_port(int): port the detector service listens on
         img_size(int): size of input image to the object detection model
+        rect(bool): letterbox camera frames to a stride aligned rectangle instead of stretching them to a square
+        auto_sizes(list): input sizes the auto mode of a stream picks from, ascending
+        auto_min_box(int): smallest box side in pixels of the detector input the auto mode keeps
+        auto_interval(int): number of detected frames between input size decisions of the auto mode
         conf_thres(float): confidence threshold for NMS
         iou_thres(float): IoU threshold for NMS
+        classes(list): class ids the detector keeps, the other class outputs are pruned from the model, empty for all classes
+        batched_nms(bool): run a single NMS call for the whole batch instead of one per image
+        pre_nms_topk(int): maximum number of candidates per image going into NMS
+        max_batch_size(int): maximum number of frames in a detector batch, 0 for the number of streams
+        batch_sizes(list): preset batch sizes every batch is padded to for backends with a static batch size, ascending, empty to not pad
+        max_wait(float): maximum time in seconds the detector waits for more frames once a frame is ready
+        temporal_window(int): number of consecutive frames of a video sent to the detector at once in EMULATOR mode, 1 to send every frame on its own
+        detector_workers(int): number of detector processes the streams are sharded across
+        detector_threads(int): number of torch threads of every detector process, 0 to split the cores evenly
+        rebalance_interval(int): seconds between checks for lagging detector processes
+        rebalance_threshold(float): relative latency above the fastest detector process at which a stream is moved
+        pipeline(bool): overlap batch assembly, inference and post processing in the detector
+        stats_interval(float): seconds between detector statistics logs
         tracker_model(str): type of object tracking model
         tracker_weights_file(str): path to weights of object tracking model
         max_cosine_distance(float): parameter of deep sort algorithm
@@ -31,8 +61,27 @@ class ParseConfig:
         iou_threshold(float): IoU threshold for object tracking model
         max_hits(int): maximum hits param for object tracking model 
         max_age(int): maximum age param for object tracking model 
+        motion_gate(bool): skip the detector on frames without motion
+        motion_threshold(int): grayscale difference above which a pixel counts as changed
+        motion_min_area(float): fraction of changed pixels above which a frame has motion
+        motion_max_skip(int): maximum number of consecutive frames skipped by the motion gate
+        motion_size(int): size of the downsampled frame used by the motion gate
+        result_cache(bool): reuse the last detections on identical frames
+        cache_max_reuse(int): maximum number of consecutive frames served from the cache before detection is forced
+        cache_frozen_alarm(int): number of consecutive cache hits after which a camera is reported frozen
+        load_shedding(bool): step the quality of the streams down when the detector falls behind
+        shed_latency_budget(float): maximum end to end latency of a stream in seconds
+        shed_max_queue_depth(int): maximum number of frames and results waiting in the queues
+        shed_headroom(float): fraction of the latency budget below which quality steps back up
+        shed_interval(int): seconds between load shedding decisions
+        shed_stride(int): a shedding stream detects every shed_stride-th frame and reuses the detections in between
+        shed_reid_interval(int): a shedding deep sort tracker refreshes the features of tracked boxes every shed_reid_interval frames
         streams(dict): keys as stream_ids and values as video path
         zones(dict): keys as stream_ids and values as zone dimensions
+        roi(dict): keys as stream_ids and values as margin in pixels around the zones sent to the detector, None for the full frame
+        image_size(dict): keys as stream_ids and values as detector input size of the stream, 0 for the auto mode
+        priority(dict): keys as stream_ids and values as weight of the stream in the detector batches
+        target_fps(dict): keys as stream_ids and values as maximum detection rate of the stream, 0 for no limit
 
     """
     def __init__(self, configfile = "configfile.ini"):
@@ -58,11 +107,57 @@ class ParseConfig:
         self.check_freq = int(parser.get('DEFAULT','CHECK_FREQUENCY',fallback=1))
         self.debug = parser.getboolean('DEFAULT','DEBUG',fallback=True)
         self.model = parser.get('DEFAULT','MODEL',fallback="REAL")
+        self.shared_memory = parser.getboolean('DEFAULT','SHARED_MEMORY',fallback=False)
+        self.ring_slots = int(parser.get('DEFAULT','SHARED_MEMORY_SLOTS',fallback=2))
+        self.frame_format = parser.get('DEFAULT','FRAME_FORMAT',fallback="BGR").upper()
+        self.trace_cache = parser.getboolean('DEFAULT','TRACE_CACHE',fallback=False)
+        self.trace_cache_dir = parser.get('DEFAULT','TRACE_CACHE_DIR',fallback="weights/trace_cache")
         self.detector_model = parser.get('DETECTOR','MODEL',fallback="yolov5n")
         self.detector_weights_file = parser.get('DETECTOR','WEIGHTS',fallback="/weights/best.pt")
+        self.backend = parser.get('DETECTOR','BACKEND',fallback="PYTORCH").upper()
+        exported = {"PYTORCH": self.detector_weights_file,
+                    "ONNX": os.path.splitext(self.detector_weights_file)[0] + ".onnx",
+                    "OPENVINO": os.path.splitext(self.detector_weights_file)[0] + "_openvino_model"}
+        self.backend_weights = parser.get('DETECTOR','BACKEND_WEIGHTS',fallback=exported[self.backend])
+        self.backend_options = {
+            "intra_op_threads": int(parser.get('BACKEND','INTRA_OP_THREADS',fallback=0)),
+            "inter_op_threads": int(parser.get('BACKEND','INTER_OP_THREADS',fallback=0)),
+            "execution_mode": parser.get('BACKEND','EXECUTION_MODE',fallback="SEQUENTIAL").lower(),
+            "graph_optimization": parser.get('BACKEND','GRAPH_OPTIMIZATION',fallback="ALL").lower(),
+            "io_buffers": int(parser.get('BACKEND','IO_BUFFERS',fallback=3)),
+        }
+        self.tuning_file = parser.get('DETECTOR','TUNING',fallback="")
+        remote = parser.get('DETECTOR','REMOTE',fallback="").strip()
+        self.remote = (remote.rsplit(":",1)[0],int(remote.rsplit(":",1)[1])) if remote else None
+        self.service_host = parser.get('SERVICE','HOST',fallback="0.0.0.0")
+        self.service_port = int(parser.get('SERVICE','PORT',fallback=5050))
         self.img_size = int(parser.get('DETECTOR','IMAGE_SIZE',fallback=640))
+        self.rect = parser.getboolean('DETECTOR','RECT',fallback=False)
+        self.auto_sizes = sorted(int(size) for size in parser.get('DETECTOR','AUTO_SIZES',fallback="320,416,640").split(","))
+        self.auto_min_box = int(parser.get('DETECTOR','AUTO_MIN_BOX',fallback=24))
+        self.auto_interval = int(parser.get('DETECTOR','AUTO_INTERVAL',fallback=300))
         self.conf_thres = float(parser.get('DETECTOR','CONFIDENCE_THRESHOLD',fallback=0.55))
         self.iou_thres = float(parser.get('DETECTOR','IoU_THRESHOLD',fallback=0.55))
+        classes = [c.strip() for c in parser.get('DETECTOR','CLASSES',fallback="").split(",") if c.strip()]
+        unknown = [c for c in classes if c not in self.names and not (c.isdigit() and int(c) < len(self.names))]
+        if unknown:
+            raise ValueError("Unknown CLASSES %s, valid names of data.yaml are %s or ids 0 to %d" % (", ".join(unknown), ", ".join(self.names), len(self.names) - 1))
+        self.classes = sorted(int(c) if c.isdigit() else self.names.index(c) for c in classes)
+        self.batched_nms = parser.getboolean('DETECTOR','BATCHED_NMS',fallback=False)
+        self.pre_nms_topk = int(parser.get('DETECTOR','PRE_NMS_TOPK',fallback=30000))
+        self.max_batch_size = int(parser.get('DETECTOR','MAX_BATCH_SIZE',fallback=0))
+        self.batch_sizes = sorted(int(size) for size in parser.get('DETECTOR','BATCH_SIZES',fallback="").split(",") if size.strip())
+        self.max_wait = float(parser.get('DETECTOR','MAX_WAIT',fallback=0.05))
+        self.temporal_window = max(int(parser.get('DETECTOR','TEMPORAL_WINDOW',fallback=1)),1) if self.model == "EMULATOR" else 1
+        self.detector_workers = int(parser.get('DETECTOR','WORKERS',fallback=1))
+        self.detector_threads = int(parser.get('DETECTOR','THREADS',fallback=0))
+        self.rebalance_interval = int(parser.get('DETECTOR','REBALANCE_INTERVAL',fallback=30))
+        self.rebalance_threshold = float(parser.get('DETECTOR','REBALANCE_THRESHOLD',fallback=0.5))
+        self.pipeline = parser.getboolean('DETECTOR','PIPELINE',fallback=False)
+        if self.pipeline and self.backend_options["io_buffers"] < 3:
+            # assembling, queued and in inference, the output of a batch must survive until it is post processed
+            raise ValueError("IO_BUFFERS = %d with PIPELINE = True, the pipelined detector holds up to 3 batches at once and needs at least 3 buffers" % self.backend_options["io_buffers"])
+        self.stats_interval = float(parser.get('DETECTOR','STATS_INTERVAL',fallback=60))
         self.data = parser.get('DETECTOR','DATA',fallback="data.yaml")
         self.tracker_model = parser.get('TRACKER','MODEL',fallback="DEEPSORT")
         if self.tracker_model == "DEEPSORT":
@@ -77,8 +172,27 @@ class ParseConfig:
             self.iou_threshold = float(parser.get('SORT','iou_threshold',fallback=0.3))
             self.max_hits = int(parser.get('SORT','min_hits',fallback=600))
             self.max_age = int(parser.get('SORT','max_age',fallback=3))
+        self.motion_gate = parser.getboolean('MOTION','ENABLED',fallback=False)
+        self.motion_threshold = int(parser.get('MOTION','THRESHOLD',fallback=25))
+        self.motion_min_area = float(parser.get('MOTION','MIN_AREA',fallback=0.002))
+        self.motion_max_skip = int(parser.get('MOTION','MAX_SKIP',fallback=25))
+        self.motion_size = int(parser.get('MOTION','SIZE',fallback=64))
+        self.result_cache = parser.getboolean('CACHE','ENABLED',fallback=False)
+        self.cache_max_reuse = int(parser.get('CACHE','MAX_REUSE',fallback=25))
+        self.cache_frozen_alarm = int(parser.get('CACHE','FROZEN_ALARM',fallback=250))
+        self.load_shedding = parser.getboolean('SHEDDING','ENABLED',fallback=False)
+        self.shed_latency_budget = float(parser.get('SHEDDING','LATENCY_BUDGET',fallback=0.5))
+        self.shed_max_queue_depth = int(parser.get('SHEDDING','MAX_QUEUE_DEPTH',fallback=50))
+        self.shed_headroom = float(parser.get('SHEDDING','HEADROOM',fallback=0.5))
+        self.shed_interval = int(parser.get('SHEDDING','INTERVAL',fallback=5))
+        self.shed_stride = int(parser.get('SHEDDING','STRIDE',fallback=2))
+        self.shed_reid_interval = int(parser.get('SHEDDING','REID_INTERVAL',fallback=5))
         self.streams = {}
         self.zones = {}
+        self.roi = {}
+        self.image_size = {}
+        self.priority = {}
+        self.target_fps = {}
         self.get_camera_specfic_details(parser)
         self.logger.debug("Config parser attributes %s",self.__dict__)
 
@@ -96,6 +210,13 @@ class ParseConfig:
             for zone in range(1,zones+1):
                 dims = parser.get(arm,'zone_dimensions_'+str(zone))
                 self.zones[arm][zone] =  [int(dim) for dim in dims.split(",")]
+            self.roi[arm] = None
+            if parser.getboolean(arm,'roi',fallback=False):
+                self.roi[arm] = int(parser.get(arm,'roi_margin',fallback=32))
+            image_size = parser.get(arm,'image_size',fallback=str(self.img_size))
+            self.image_size[arm] = 0 if image_size.lower() == "auto" else int(image_size)
+            self.priority[arm] = float(parser.get(arm,'priority',fallback=1.0))
+            self.target_fps[arm] = float(parser.get(arm,'target_fps',fallback=0))
 
 def get_config(global_var,configfile):
     """Creates an instance of ConfigFileparser and stores it in the global_var dictionary
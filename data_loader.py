@@ -1,29 +1,173 @@
+import os
+import cv2
 import numpy as np
 import torch
 
+# BT.601 limited range I420 to RGB, the coefficients of OpenCV COLOR_YUV2RGB_I420, with the 1 / 255 scaling folded in
+YUV_Y = 1.164 / 255.0
+YUV_RV, YUV_GU, YUV_GV, YUV_BU = 1.596 / 255.0, -0.391 / 255.0, -0.813 / 255.0, 2.018 / 255.0
+
+def to_i420(frame):
+    """
+    Args:
+        frame (numpy array): h x w BGR frame, h and w even
+
+    Returns:
+        frame (numpy array): 3h/2 x w I420 frame, the Y plane followed by the quarter size U and V planes
+    """
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+
+def image_shape(frame):
+    """
+    Returns:
+        shape (tuple): (height, width) of a BGR frame or of the image held by an I420 frame
+    """
+    if frame.ndim == 2:
+        return frame.shape[0] * 2 // 3, frame.shape[1]
+    return frame.shape[:2]
+
+def sample_frames(config,count,offset=0.0):
+    """samples frames evenly from the videos of the EMULATOR stream folders
+
+    Args:
+        config (ParseConfig): ParseConfig Object
+        count (int): number of frames
+        offset (float): fraction of the sampling step to shift by, used to keep evaluation frames apart from calibration frames
+
+    Returns:
+        frames (list): img_size x img_size frames
+    """
+    videos = []
+    for arm in config.arms:
+        video_dir_path = config.streams[arm] + "/" + arm
+        videos += [video_dir_path + "/" + video for video in sorted(os.listdir(video_dir_path))]
+    if not videos:
+        raise ValueError("No videos found in the stream folders")
+    frames = []
+    per_video = -(-count // len(videos))
+    for video in videos:
+        cap = cv2.VideoCapture(video)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        step = total / per_video
+        for ind in range(per_video):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int((ind + offset) * step))
+            ret, frame = cap.read()
+            if ret:
+                frames.append(cv2.resize(frame,(config.img_size,config.img_size)))
+        cap.release()
+    return frames[:count]
+
 class StreamData():
     """
-    Batches images into a single numpy array of 4 dimensions
+    Batches images into a single tensor of 4 dimensions.
+    Frames are written straight into a persistent batch buffer, the BGR to RGB reorder,
+    HWC to CHW transpose, uint8 to float conversion and scaling happen in one pass per channel.
+    I420 frames, 2 dimensional, are stacked as they are and converted to RGB for the whole batch at once.
 
     Args:
         device(int): device to run the Machine Learning model.ie., GPU or CPU
+        batch_size(int): number of frames the buffers are allocated for, ex: number of streams
+        img_size(int): height and width of the frames the buffers are allocated for
+        buffers(int): number of buffers used in rotation, more than one when batches overlap in a pipeline
+
+    Attributes:
+        device(int): device to run the Machine Learning model.ie., GPU or CPU
+        batch_size(int): number of frames the buffers are allocated for
+        buffers(int): number of buffers used in rotation
+        pools(dict): keys as (height, width) and values as list of float batch buffers
+        staging(dict): keys as the uint8 frame shape and values as (pinned host, device) uint8 buffers, only used on GPU
+        index(dict): keys as (height, width) and values as the next buffer in rotation
     """
-    def __init__(self,device):
+    def __init__(self,device,batch_size=1,img_size=640,buffers=1):
         self.device = device
+        self.batch_size = batch_size
+        self.buffers = buffers
+        self.pools = {}
+        self.staging = {}
+        self.index = {}
+        self.get_buffer(batch_size,img_size,img_size)
 
-    def pre_process(self, img):
+    def get_buffer(self,n,h,w):
+        """next batch buffer in rotation for frames of the given size, reallocated only when the batch grows
+
+        Args:
+            n (int): number of frames in the batch
+            h (int): frame height
+            w (int): frame width
+
+        Returns:
+            buffer (tensor): float buffer of shape (batch_size,3,h,w)
+        """
+        key = (h,w)
+        if key not in self.pools or self.pools[key][0].shape[0] < n:
+            self.batch_size = max(self.batch_size,n)
+            self.pools[key] = [torch.empty((self.batch_size,3,h,w),dtype=torch.float32,device=self.device) for _ in range(self.buffers)]
+            self.index[key] = 0
+        ind = self.index[key]
+        self.index[key] = (ind + 1) % self.buffers
+        return self.pools[key][ind]
+
+    def pre_process(self, img, padded=0):
         """pre process images to load them into model
 
         Args:
-            img (numpy array): frame from video
+            img (list): frames from video, all of the same shape
+            padded (int): batch size to pad the frames to with blank frames, for backends with a static batch size
+
+        Returns:
+            img (tensor): processed frames
+        """
+        n = len(img)
+        h,w = image_shape(img[0])
+        size = max(n,padded)
+        buffer = self.get_buffer(size,h,w)
+        if img[0].ndim == 2:
+            self.i420_to_rgb(self.stage(img),buffer[:n])
+        elif buffer.device.type == 'cpu':
+            for ind,frame in enumerate(img):
+                frame = torch.from_numpy(frame)
+                for c in range(3):
+                    torch.mul(frame[..., 2 - c], 1 / 255.0, out=buffer[ind, c])  # BGR to RGB, HWC to CHW, scale
+        else:
+            staged = self.stage(img)
+            for c in range(3):
+                torch.mul(staged[:n, ..., 2 - c], 1 / 255.0, out=buffer[:n, c])  # BGR to RGB, HWC to CHW, scale
+        if size > n:
+            buffer[n:size].zero_()
+        return buffer[:size]
+
+    def stage(self,img):
+        """stacks the uint8 frames into a tensor on the device, through a pinned host buffer on GPU
+
+        Args:
+            img (list): frames from video, all of the same shape
 
         Returns:
-            img (tensor): processed frame
+            staged (tensor): uint8 tensor of shape (n,) + frame shape
+        """
+        n = len(img)
+        if torch.device(self.device).type == 'cpu':
+            return torch.from_numpy(np.stack(img))
+        key = img[0].shape
+        if key not in self.staging or self.staging[key][0].shape[0] < n:
+            host = torch.empty((self.batch_size,) + key,dtype=torch.uint8).pin_memory()
+            self.staging[key] = host, torch.empty_like(host,device=self.device)
+        host,staged = self.staging[key]
+        for ind,frame in enumerate(img):
+            host[ind].numpy()[...] = frame
+        staged[:n].copy_(host[:n])
+        return staged[:n]
+
+    def i420_to_rgb(self,yuv,out):
+        """batched I420 to RGB conversion, nearest chroma upsampling like OpenCV
+
+        Args:
+            yuv (tensor): uint8 I420 frames of shape (n, 3h/2, w)
+            out (tensor): float buffer of shape (n, 3, h, w) the RGB frames scaled to [0, 1] are written to
         """
-        img = np.array(img)
-        img = img[:,:, :, ::-1].transpose(0,3,1,2)  # BGR to RGB, to 3x416x416
-        img = np.ascontiguousarray(img)
-        img = torch.from_numpy(img).to(self.device)
-        img = img.float()
-        img /= 255.0 
-        return img
\ No newline at end of file
+        n,h,w = out.shape[0],out.shape[2],out.shape[3]
+        u,v = (yuv[:, h + ind * h // 4:h + (ind + 1) * h // 4].reshape(n,h // 2,w // 2).float().sub_(128) for ind in range(2))
+        chroma = torch.stack((v * YUV_RV,torch.add(v * YUV_GV,u,alpha=YUV_GU),u * YUV_BU),1).sub_(16 * YUV_Y)  # quarter resolution
+        chroma = torch.nn.functional.interpolate(chroma,size=(h,w),mode='nearest')  # every 2x2 pixel block shares one chroma sample
+        torch.add(chroma,yuv[:, None, :h].float(),alpha=YUV_Y,out=out)
+        out.clamp_(0,1)
@@ -1,10 +1,19 @@
+import os
+import time
+import cv2
+import numpy as np
 import torch
+import yaml
 
-from .utils.general import non_max_suppression
+from .utils.general import non_max_suppression, batched_non_max_suppression
 from .utils.torch_utils import select_device
 from .models.common import DetectMultiBackend
 from .config_parser import get_config
-from .data_loader import StreamData
+from .data_loader import StreamData, image_shape, to_i420
+from .scheduler import BatchScheduler
+from .pipeline import Pipeline
+from .trace_cache import TracedModel
+from .frame_transform import InputTransform, FRAME_SIZE
 from .storage import global_var
 
 class Detect:
@@ -16,16 +25,158 @@ class Detect:
         config (ConfigFileparser): Instance of ConfigFileparser class
         device(int): device to run the Machine Learning model.ie., GPU or CPU
         detector_model(DetectMultiBackend): object detection model
+        class_map(Tensor): class id of every class output kept in the model, None for all classes
+        columns(list): prediction columns of the box, objectness and kept classes, sliced before NMS on backends whose model is not pruned, None otherwise
+        end2end(bool): the model runs NMS in its graph and outputs final (n, 7) detections of the batch
         data(StreamData): Instance of StreamData to preprocess video frames
+        pipeline(Pipeline): overlapping detector stages, None unless PIPELINE is enabled
+        worker(int): index of this detector worker
+        latency(Array): moving average batch latency of every worker in seconds, None when not sharded
+        started(float): time the detector was launched, used to log the time to the first detection
     """
     def __init__(self,configfile):
         self.config = get_config(global_var,configfile)
         self.device = select_device(self.config.device)
-        self.detector_model = DetectMultiBackend(self.config.detector_weights_file, data=self.config.data, device=self.device)
-        self.data = StreamData(device=self.device)
+        self.load_tuning()
+        window = self.config.temporal_window
+        if self.config.batch_sizes:
+            # batches never exceed the largest preset batch size, so every sub-batch pads to a single preset
+            self.config.max_batch_size = min(self.config.max_batch_size or len(self.config.arms) * window, self.config.batch_sizes[-1])
+            if self.config.max_batch_size < window:
+                raise ValueError("TEMPORAL_WINDOW %d does not fit in the largest of BATCH_SIZES %d" % (window, self.config.max_batch_size))
+        classes = self.config.classes
+        self.class_map = torch.tensor(classes, device=self.device) if classes else None
+        self.columns = list(range(5)) + [5 + c for c in classes] if classes else None
+        self.detector_model = self.load_model()
+        self.end2end = getattr(self.detector_model, "end2end", False)
+        if self.end2end:
+            self.columns = None  # classes are filtered after the NMS of the graph
+        batch_size = self.config.max_batch_size if self.config.max_batch_size > 0 else len(self.config.arms) * window
+        # a pipelined detector holds up to three batches at once: assembling, queued and in inference
+        self.data = StreamData(self.device, batch_size, self.config.img_size, buffers=3 if self.config.pipeline else 1)
+        self.pipeline = None
+        self.worker = 0
+        self.latency = None
+        self.started = None
+
+    def load_tuning(self):
+        """
+        Applies the backend, batch size and threads picked by autotune from the TUNING file
+        """
+        path = self.config.tuning_file
+        if not path or not os.path.exists(path):
+            return
+        with open(path) as f:
+            tuning = yaml.safe_load(f)
+        workers = max(1,min(self.config.detector_workers,len(self.config.arms)))  # clamped like DetectorPool and autotune
+        if tuning["cpu_count"] != os.cpu_count() or tuning["workers"] != workers or tuning["streams"] != len(self.config.arms):
+            self.config.logger.warning("Tuning %s was made for %d cores, %d detectors and %d streams", path, tuning["cpu_count"], tuning["workers"], tuning["streams"])
+        self.config.backend = tuning["backend"]
+        self.config.backend_weights = tuning["backend_weights"]
+        self.config.trace_cache = tuning["trace_cache"]
+        self.config.max_batch_size = tuning["max_batch_size"]
+        self.config.backend_options["intra_op_threads"] = tuning["threads"]
+        torch.set_num_threads(tuning["threads"])
+        self.config.logger.debug("Detector tuning loaded from %s: %s", path, tuning)
+
+    def load_model(self):
+        """loads the object detection model on the configured backend
+
+        Returns:
+            model (DetectMultiBackend): object detection model, TracedModel when the PyTorch model runs from the trace cache
+        """
+        weights = self.config.backend_weights
+        if self.config.backend == "PYTORCH":
+            self.columns = None  # the Detect head is pruned instead
+        if self.config.trace_cache and self.config.backend == "PYTORCH":
+            build = lambda: self.prune(DetectMultiBackend(weights, data=self.config.data, device=self.device).eval())
+            name = "detector_" + "-".join(str(c) for c in self.config.classes) if self.config.classes else "detector"
+            return TracedModel(weights, build, self.device, self.config.trace_cache_dir, name, self.config.logger)
+        pt, _, onnx, xml = DetectMultiBackend.model_type(weights)[:4]
+        if not {"PYTORCH": pt, "ONNX": onnx, "OPENVINO": xml}.get(self.config.backend, False):
+            raise ValueError("Weights %s do not match backend %s" % (weights, self.config.backend))
+        options = dict(self.config.backend_options)
+        options["intra_op_threads"] = options["intra_op_threads"] or torch.get_num_threads()
+        model = DetectMultiBackend(weights, data=self.config.data, device=self.device, options=options)
+        return self.prune(model) if pt else model
+
+    def prune(self,model):
+        """removes the outputs of the classes missing from CLASSES from the Detect head of a PyTorch model
+
+        Args:
+            model (DetectMultiBackend): PyTorch object detection model
+
+        Returns:
+            model (DetectMultiBackend): model predicting only the kept classes
+        """
+        if self.config.classes:
+            model.model.model[-1].prune(self.config.classes)
+            self.config.logger.debug("Detector head pruned to classes %s", [self.config.names[c] for c in self.config.classes])
+        return model
+
+    def stream_resolution(self,arm_id):
+        """resolution of the camera frames of a stream, read from the first video of the folder in EMULATOR mode
+
+        Args:
+            arm_id (str): stream id
+
+        Returns:
+            shape (tuple): (height, width) of the frames, None when the stream can not be opened
+        """
+        path = self.config.streams[arm_id]
+        if self.config.model == "EMULATOR" and os.path.isdir(path + "/" + arm_id):
+            videos = sorted(os.listdir(path + "/" + arm_id))
+            path = path + "/" + arm_id + "/" + videos[0] if videos else path
+        cap = cv2.VideoCapture(path)
+        h,w = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        cap.release()
+        return (h,w) if h > 0 and w > 0 else None
+
+    def input_shapes(self):
+        """detector input shapes the streams can send, covering the region of interest, rect mode,
+        the per stream input size, every size of the auto mode and the reduced size of load shedding
+
+        Returns:
+            shapes (list): (height, width) of every input shape
+        """
+        shapes = set()
+        blank = np.zeros((FRAME_SIZE, FRAME_SIZE, 3), dtype=np.uint8)
+        for arm in self.config.arms:
+            transform = InputTransform(self.config,arm)
+            raw = None
+            if transform.rect:
+                resolution = self.stream_resolution(arm)
+                if resolution is None:
+                    self.config.logger.warning("%s can not be opened, its rect input shape is not warmed up", arm)
+                    continue
+                raw = np.zeros(resolution + (3,), dtype=np.uint8)
+            for size in transform.auto_sizes if transform.auto else [transform.img_size]:
+                transform.img_size = size
+                for reduced in (False, True) if self.config.load_shedding else (False,):
+                    transform.reduced = reduced
+                    shapes.add(transform.apply(blank,raw).shape[:2])
+        return sorted(shapes)
+
+    def warmup(self):
+        """
+        Runs the whole detection path on blank frames of every input shape of the streams at the real
+        batch shape, so the first batches of the streams do not pay for lazy initialisation of the model,
+        the traces and the buffers
+        """
+        t1 = time.time()
+        shapes = self.input_shapes()
+        for shape in shapes:
+            frame = np.zeros(shape + (3,), dtype=np.uint8)
+            if self.config.frame_format == "I420":
+                frame = to_i420(frame)
+            for batch_size in self.config.batch_sizes or [self.data.batch_size]:
+                for _ in range(2):
+                    self.detect([frame] * batch_size)
+        self.config.logger.debug("Detector %d warmed up input shapes %s with batch size %s in %.2fs", self.worker, shapes,
+                                 self.config.batch_sizes or self.data.batch_size, time.time() - t1)
 
     def detect(self,frames):
-        """Object detection and NMS
+        """Object detection and NMS, frames of different shapes run as separate sub-batches
 
         Args:
             frames (list): list of video frames from all streams
@@ -33,29 +184,100 @@ class Detect:
         Returns:
             dets (list): list of detector predictions
         """
-        with torch.no_grad():
-            images = self.data.pre_process(frames)
-            det = self.detector_model(images)
-            det = non_max_suppression(det, self.config.conf_thres, self.config.iou_thres)
-            dets = []
-            for pred in det:
-                pred[:, [0, 2]] = pred[:, [0, 2]].clip(0, frames[0].shape[1])  # x1, x2
-                pred[:, [1, 3]] = pred[:, [1, 3]].clip(0, frames[0].shape[0])
-                pred = pred.cpu().numpy()
-                dets.append(pred)
-        return dets
-
-    def get_from_queue(self,queue):
-        """get frame from queue
+        groups = self.pre_process(frames)
+        groups = self.inference(groups)
+        return self.post_process(groups,[image_shape(frame) for frame in frames])
+
+    def pre_process(self,frames):
+        """groups the frames by shape, then stacks and normalises every group into a sub-batch
 
         Args:
-            queue (Queue): Queue for respective stream
+            frames (list): list of video frames from all streams
+
+        Returns:
+            groups (list): list of (frame indices, tensor of processed frames) per frame shape
+        """
+        shapes = {}
+        for ind,frame in enumerate(frames):
+            shapes.setdefault(frame.shape,[]).append(ind)
+        return [(indices,self.data.pre_process([frames[ind] for ind in indices],self.padded(len(indices)))) for indices in shapes.values()]
+
+    def padded(self,n):
+        """
+        Args:
+            n (int): number of frames in a sub-batch
+
+        Returns:
+            size (int): smallest preset batch size holding n frames, 0 when batches are not padded
+        """
+        return next((size for size in self.config.batch_sizes if size >= n), 0)
+
+    @torch.no_grad()
+    def inference(self,groups):
+        """forward pass of the object detection model on every sub-batch
+
+        Args:
+            groups (list): list of (frame indices, tensor of processed frames)
+
+        Returns:
+            groups (list): list of (frame indices, raw detector predictions)
+        """
+        return [(indices,self.detector_model(images)) for indices,images in groups]
+
+    @torch.no_grad()
+    def post_process(self,groups,shapes):
+        """NMS and clipping of the predictions to the frames.
+        Detections of the whole batch are clipped and moved to host memory at once, then split
+        into per frame views of a single numpy array.
+
+        Args:
+            groups (list): list of (frame indices, raw detector predictions)
+            shapes (list): (height, width) of every frame in the batch
+
+        Returns:
+            dets (list): list of detector predictions
+        """
+        dets = []
+        for indices,det in groups:
+            if self.end2end:
+                det = self.filter_end2end(det,len(indices))
+            else:
+                det = det[:len(indices)]  # outputs of padded frames are discarded
+                if self.columns is not None:
+                    det = det[..., self.columns]  # candidates of the other classes never reach NMS
+                if self.config.batched_nms:
+                    det = batched_non_max_suppression(det, self.config.conf_thres, self.config.iou_thres, max_nms=self.config.pre_nms_topk)
+                else:
+                    det = non_max_suppression(det, self.config.conf_thres, self.config.iou_thres, max_nms=self.config.pre_nms_topk)
+                    det = torch.cat([torch.cat((pred, torch.full_like(pred[:, :1], ind)), 1) for ind,pred in enumerate(det)])
+                if self.class_map is not None:
+                    det[:, 5] = self.class_map[det[:, 5].long()].to(det.dtype)  # class ids of the full model
+            det[:, 6] = torch.tensor(indices, dtype=det.dtype, device=det.device)[det[:, 6].long()]  # frame index in the batch
+            dets.append(det)
+        det = torch.cat(dets)
+        limits = torch.tensor([[shape[1], shape[0], shape[1], shape[0]] for shape in shapes], dtype=det.dtype, device=det.device)
+        det[:, :4] = torch.min(det[:, :4].clamp(0), limits[det[:, 6].long()])  # x1, y1, x2, y2
+        det = det.cpu().numpy()
+        if len(groups) > 1:
+            det = det[np.argsort(det[:, 6], kind='stable')]
+        counts = np.bincount(det[:, 6].astype(np.int64), minlength=len(shapes))
+        return np.split(det[:, :6], np.cumsum(counts)[:-1])
+
+    def filter_end2end(self,det,count):
+        """drops detections of an end-to-end model from padded frames, below CONFIDENCE_THRESHOLD or outside CLASSES.
+        The graph applies the thresholds it was exported with, these only tighten them.
+
+        Args:
+            det (Tensor): (n, 7) detections of a sub-batch
+            count (int): number of real frames in the sub-batch
 
         Returns:
-            frame (numpy array): frame from live stream or video
+            det (Tensor): kept detections
         """
-        frame = queue.get()
-        return frame
+        keep = (det[:, 6] < count) & (det[:, 4] > self.config.conf_thres)
+        if self.class_map is not None:
+            keep &= (det[:, 5:6] == self.class_map.to(det.dtype)).any(1)
+        return det[keep]
 
     def put_in_queue(self,dets,queue):
         """puts predictions of frame in queue
@@ -67,36 +289,138 @@ class Detect:
         if queue.empty():
             queue.put(dets)
 
-    def process(self,send_queues,recv_queues):
+    def dispatch(self,streams,det,recv_queues,started):
+        """puts the predictions of a batch in the queues of their streams and updates the worker latency
+
+        Args:
+            streams (list): stream index of every frame in the batch
+            det (list): list of detector predictions
+            recv_queues (List): List of queues to receive predicitions from main thread
+            started (float): time the batch was released by the scheduler
+        """
+        if self.config.temporal_window > 1:
+            # every stream sent a window of frames and gets back the list of their predictions
+            windows = {}
+            for ind,pred in zip(streams,det):
+                windows.setdefault(ind,[]).append(pred)
+            det,streams = list(windows.values()),list(windows)
+        for ind,pred in zip(streams,det):
+            self.put_in_queue(pred,recv_queues[ind])
+        if self.started is not None:
+            self.config.logger.debug("Detector %d first detection %.2fs after startup", self.worker, time.time() - self.started)
+            self.started = None
+        if self.latency is not None:
+            latency = time.time() - started
+            self.latency[self.worker] = latency if self.latency[self.worker] == 0 else 0.9 * self.latency[self.worker] + 0.1 * latency
+
+    def process(self,send_queues,recv_queues,rings=None,worker=0,assignment=None,latency=None,ready=None,started=None):
         """Process the input video frames and output predicitions
 
         Args:
             send_queues (List): List of queues to send predicitions to main thread
             recv_queues (List): List of queues to receive predicitions from main thread
+            rings (List): List of shared memory rings of each stream, None when frames are pickled
+            worker (int): index of this detector worker
+            assignment (Array): worker index of every stream, None when a single worker handles all streams
+            latency (Array): moving average batch latency of every worker in seconds
+            ready (Event): set once the model is warmed up and the streams can start sending frames
+            started (float): time the detector was launched, None to skip logging the time to the first detection
         """
+        self.worker = worker
+        self.latency = latency
+        self.started = started
+        self.warmup()
+        if ready is not None:
+            ready.set()
+        weights = [self.config.priority[arm] for arm in self.config.arms]
+        target_fps = [self.config.target_fps[arm] for arm in self.config.arms]
+        scheduler = BatchScheduler(send_queues,rings,self.config.max_batch_size,self.config.max_wait,assignment,worker,weights,target_fps,self.config.temporal_window)
+        if self.config.pipeline:
+            self.process_pipelined(scheduler,recv_queues)
+        last_report = time.time()
         while True:
-            data = []
-            for queue in send_queues:
-                frame = self.get_from_queue(queue)
-                data.append(frame)
+            streams,data = scheduler.next_batch()
+            started = time.time()
             det = self.detect(data)
-            ind = 0
-            for queue in recv_queues:
-                self.put_in_queue(det[ind],queue)
-                ind += 1
+            self.dispatch(streams,det,recv_queues,started)
+            if started - last_report > self.config.stats_interval:
+                self.log_fps(scheduler)
+                last_report = started
+
+    def log_fps(self,scheduler):
+        """logs the achieved detection rate of every stream of this worker against its target
 
-def run_detect(send,recv,configfile):
+        Args:
+            scheduler (BatchScheduler): collects frames from the streams into batches
+        """
+        fps = scheduler.report()
+        self.config.logger.debug("Detector %d stream FPS %s", self.worker, ", ".join(
+            "%s %.1f/%s" % (self.config.arms[ind], achieved, "%.1f" % target if target > 0 else "-") for ind,(achieved,target) in fps.items()))
+
+    def process_pipelined(self,scheduler,recv_queues):
+        """Runs batch assembly, inference and post processing as overlapping stages,
+        so batch N+1 is assembled and batch N-1 post processed while batch N runs through the model.
+        Stage utilisation is logged every STATS_INTERVAL seconds to show the bottleneck.
+
+        Args:
+            scheduler (BatchScheduler): collects frames from the streams into batches
+            recv_queues (List): List of queues to receive predicitions from main thread
+        """
+        def assemble(batch):
+            streams,data = batch
+            return streams,time.time(),[image_shape(frame) for frame in data],self.pre_process(data)
+
+        def infer(batch):
+            streams,started,shapes,groups = batch
+            return streams,started,shapes,self.inference(groups)
+
+        def finish(batch):
+            streams,started,shapes,groups = batch
+            self.dispatch(streams,self.post_process(groups,shapes),recv_queues,started)
+
+        self.pipeline = Pipeline(scheduler.next_batch,[("assemble",assemble),("inference",infer),("postprocess",finish)])
+        self.pipeline.start()
+        while self.pipeline.is_alive():
+            time.sleep(self.config.stats_interval)
+            utilisation = self.pipeline.utilisation()
+            self.config.logger.debug("Detector %d stage utilisation %s", self.worker, ", ".join("%s %.0f%%" % (name, 100 * u) for name,u in utilisation.items()))
+            self.log_fps(scheduler)
+        raise RuntimeError("Detector pipeline stage stopped running")
+
+def run_detect(send,recv,configfile,rings=None,worker=0,assignment=None,latency=None,threads=0,ready=None,started=None):
     """process input frames
 
     Args:
         send (List): List of queues to send predicitions to main thread
         recv (List): List of queues to receive predicitions from main thread
         configfile(str): path to configfile, ex: 'configfile.ini'
+        rings (List): List of shared memory rings of each stream, None when frames are pickled
+        worker (int): index of this detector worker
+        assignment (Array): worker index of every stream, None when a single worker handles all streams
+        latency (Array): moving average batch latency of every worker in seconds
+        threads (int): number of torch threads of this worker, 0 keeps the torch default
+        ready (Event): set once the model is warmed up and the streams can start sending frames
+        started (float): time the detector was launched, None to skip logging the time to the first detection
+
+    Returns:
+        Detect Instance: Instance of Detect Class
+    """
+    if threads > 0:
+        torch.set_num_threads(threads)
+    detector = get_detect_object(global_var,configfile)
+    detector.process(send,recv,rings,worker,assignment,latency,ready,started)
+    return detector
+
+def get_detect_object(global_var,configfile):
+    """Creates an instance of Detect and stores it in the global_var dictionary
+
+    Args:
+        global_var (dict): to store all the classes initated
+        configfile(str): path to configfile, ex: 'configfile.ini'
 
     Returns:
         Detect Instance: Instance of Detect Class
     """
     if "Detect" not in global_var:
         global_var["Detect"] = Detect(configfile)
-    global_var["Detect"].process(send,recv)
-    return global_var["Detect"]
\ No newline at end of file
+    return global_var["Detect"]
@@ -0,0 +1,127 @@
+import os
+import time
+import torch.multiprocessing as mp
+
+from .detect import run_detect
+from .frame_ring import FrameRing
+from .frame_transform import max_input_size
+
+class DetectorPool:
+    """
+    Creates the queues between the streams and the detector, starts the detector workers and shards
+    the streams across them. Streams of a lagging worker are moved to the fastest worker.
+
+    Args:
+        config (ParseConfig): ParseConfig Object
+        configfile (str): configfile location
+
+    Attributes:
+        config (ParseConfig): ParseConfig Object
+        configfile (str): configfile location
+        logger (logging): logger object
+        workers (int): number of detector worker processes
+        threads (int): number of torch threads of every worker
+        send_queues (dict): keys as stream index and values as queue objects to send frames to the detector
+        recv_queues (dict): keys as stream index and values as queue objects to receive detections
+        rings (dict): keys as stream index and values as FrameRing objects, empty when frames are pickled
+        assignment (Array): worker index of every stream
+        latency (Array): moving average batch latency of every worker in seconds, 0 until measured
+        ready (list): one Event per worker, set once the worker is warmed up
+    """
+    def __init__(self,config,configfile):
+        self.config = config
+        self.configfile = configfile
+        self.logger = config.logger
+        streams = len(config.arms)
+        self.workers = max(1,min(config.detector_workers,streams))
+        self.threads = config.detector_threads if config.detector_threads > 0 else max(1,(os.cpu_count() or 1) // self.workers)
+        self.send_queues = {}
+        self.recv_queues = {}
+        self.rings = {}
+        frame_size = max_input_size(config)
+        frame_shape = (frame_size * 3 // 2, frame_size) if config.frame_format == "I420" else (frame_size, frame_size, 3)
+        for ind in range(streams):
+            self.send_queues[ind] = mp.Queue()
+            self.recv_queues[ind] = mp.Queue()
+            if config.shared_memory:
+                self.rings[ind] = FrameRing(max(config.ring_slots,config.temporal_window), frame_shape)
+        self.assignment = mp.Array('i', [ind % self.workers for ind in range(streams)])
+        self.latency = mp.Array('d', self.workers)
+        self.ready = [mp.Event() for _ in range(self.workers)]
+
+    def worker_name(self,worker):
+        """
+        Args:
+            worker (int): index of the worker
+
+        Returns:
+            name (str): key of the worker in the processes dict
+        """
+        return "detector_" + str(worker)
+
+    def start_worker(self,worker,processes):
+        """starts one detector worker process
+
+        Args:
+            worker (int): index of the worker
+            processes (dict): multi process dict
+        """
+        self.logger.debug("Starting detector process %d with %d threads", worker, self.threads)
+        send = [self.send_queues[ind] for ind in sorted(self.send_queues)]
+        recv = [self.recv_queues[ind] for ind in sorted(self.recv_queues)]
+        rings = [self.rings[ind] for ind in sorted(self.rings)] if self.rings else None
+        self.latency[worker] = 0
+        self.ready[worker].clear()
+        p = mp.Process(target = run_detect, args=(send,recv,self.configfile,rings,worker,self.assignment,self.latency,self.threads,self.ready[worker],time.time(),))
+        processes[self.worker_name(worker)] = p
+        p.start()
+
+    def start(self,processes):
+        """starts all the detector workers
+
+        Args:
+            processes (dict): multi process dict
+        """
+        for worker in range(self.workers):
+            self.start_worker(worker,processes)
+
+    def restart(self,name,processes):
+        """restarts a stopped detector worker, its streams stay assigned to it
+
+        Args:
+            name (str): key of the worker in the processes dict
+            processes (dict): multi process dict
+
+        Returns:
+            restarted (bool): False if name is not a detector worker
+        """
+        for worker in range(self.workers):
+            if self.worker_name(worker) == name:
+                self.start_worker(worker,processes)
+                return True
+        return False
+
+    def rebalance(self):
+        """
+        Moves one stream from the slowest worker to the fastest one when the slowest lags by more than REBALANCE_THRESHOLD
+        """
+        latency = self.latency[:]
+        if self.workers < 2 or 0 in latency:
+            return
+        slow = latency.index(max(latency))
+        fast = latency.index(min(latency))
+        streams = [ind for ind,worker in enumerate(self.assignment[:]) if worker == slow]
+        if len(streams) < 2 or latency[slow] <= latency[fast] * (1 + self.config.rebalance_threshold):
+            return
+        self.assignment[streams[-1]] = fast
+        self.latency[slow] = 0
+        self.latency[fast] = 0
+        self.logger.debug("Detector %d lags (%.3fs vs %.3fs), moved stream %s to detector %d", slow, latency[slow], latency[fast], self.config.arms[streams[-1]], fast)
+
+    def close(self):
+        """
+        Releases the shared memory rings
+        """
+        for _,ring in self.rings.items():
+            ring.close()
+        self.rings = {}
@@ -0,0 +1,333 @@
+import argparse
+import queue
+import socket
+import struct
+import threading
+import time
+import numpy as np
+
+from .config_parser import get_config
+from .storage import global_var
+
+# request:  header (magic, number of frames, request id), then per frame (height, width, channels) and the uint8 pixels
+# response: header (magic, number of frames, request id), then per frame the number of rows and the float32 (rows, 6) detections
+MAGIC = b"VDET"
+HEADER = struct.Struct("!4sHI")
+FRAME = struct.Struct("!HHB")
+ROWS = struct.Struct("!I")
+
+def recv_exact(sock,n,out=None):
+    """reads exactly n bytes from the socket
+
+    Args:
+        sock (socket): connected socket
+        n (int): number of bytes
+        out (memoryview): buffer to read into, a new one is allocated when None
+
+    Returns:
+        out (memoryview): n bytes read
+    """
+    out = memoryview(bytearray(n)) if out is None else out
+    read = 0
+    while read < n:
+        count = sock.recv_into(out[read:], n - read)
+        if count == 0:
+            raise ConnectionError("Connection closed by peer")
+        read += count
+    return out
+
+def read_header(sock):
+    """
+    Returns:
+        count, request_id (tuple): number of frames and id of the message
+    """
+    magic,count,request_id = HEADER.unpack(recv_exact(sock,HEADER.size))
+    if magic != MAGIC:
+        raise ConnectionError("Unknown message %r" % magic)
+    return count,request_id
+
+def send_frames(sock,frames,request_id):
+    """sends a request with the frames"""
+    sock.sendall(HEADER.pack(MAGIC,len(frames),request_id))
+    for frame in frames:
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        h,w = frame.shape[:2]
+        sock.sendall(FRAME.pack(h,w,frame.shape[2] if frame.ndim == 3 else 1))
+        sock.sendall(memoryview(frame.reshape(-1)))
+
+def check_frame(h,w,c,stride=32,max_side=640):
+    """rejects frames the detector can not run on, or that are too large, before their pixels are read
+
+    Args:
+        h (int): rows of the frame, 3/2 of the image height for I420
+        w (int): columns of the frame
+        c (int): channels, 3 for BGR and 1 for I420
+        stride (int): model stride the image sides must be a multiple of
+        max_side (int): largest image side accepted
+    """
+    if c not in (1, 3):
+        raise ValueError("Frame with %d channels, 3 for BGR or 1 for I420" % c)
+    height = h * 2 // 3 if c == 1 else h
+    if c == 1 and height * 3 != h * 2:
+        raise ValueError("I420 frame with %d rows is not 3/2 of an image height" % h)
+    if height == 0 or w == 0 or height % stride or w % stride:
+        raise ValueError("Frame of %dx%d is not a multiple of the stride %d" % (w, height, stride))
+    if height > max_side or w > max_side:
+        raise ValueError("Frame of %dx%d is larger than %d" % (w, height, max_side))
+
+def recv_frames(sock,stride=32,max_side=640,max_frames=64):
+    """
+    Args:
+        sock (socket): connected socket
+        stride (int): model stride the image sides must be a multiple of
+        max_side (int): largest image side accepted
+        max_frames (int): largest number of frames accepted in a request
+
+    Returns:
+        frames, request_id (tuple): frames of the request and its id
+    """
+    count,request_id = read_header(sock)
+    if count == 0 or count > max_frames:
+        raise ValueError("Request %d has %d frames, 1 to %d are accepted" % (request_id, count, max_frames))
+    frames = []
+    for _ in range(count):
+        h,w,c = FRAME.unpack(recv_exact(sock,FRAME.size))
+        check_frame(h,w,c,stride,max_side)
+        frame = np.empty((h,w,c) if c > 1 else (h,w), dtype=np.uint8)
+        recv_exact(sock,frame.nbytes,memoryview(frame.reshape(-1)))
+        frames.append(frame)
+    return frames,request_id
+
+def send_dets(sock,dets,request_id):
+    """sends a response with the detections of every frame"""
+    parts = [HEADER.pack(MAGIC,len(dets),request_id)]
+    for det in dets:
+        det = np.ascontiguousarray(det, dtype=np.float32)
+        parts += [ROWS.pack(det.shape[0]), det.tobytes()]
+    sock.sendall(b"".join(parts))
+
+def recv_dets(sock):
+    """
+    Returns:
+        dets, request_id (tuple): detections of every frame and the id of the request
+    """
+    count,request_id = read_header(sock)
+    dets = []
+    for _ in range(count):
+        rows, = ROWS.unpack(recv_exact(sock,ROWS.size))
+        det = np.empty((rows,6), dtype=np.float32)
+        recv_exact(sock,det.nbytes,memoryview(det.reshape(-1)).cast("B"))
+        dets.append(det)
+    return dets,request_id
+
+class Request:
+    """
+    Request of a client, its frames can be spread over several detector batches
+
+    Args:
+        connection (socket): connection of the client
+        request_id (int): id of the request
+        frames (list): frames of the request
+
+    Attributes:
+        connection (socket): connection of the client
+        request_id (int): id of the request
+        frames (list): frames of the request
+        dets (list): detections of the frames detected so far
+        failed (bool): the detector failed on the request and its connection was closed
+    """
+    def __init__(self,connection,request_id,frames):
+        self.connection = connection
+        self.request_id = request_id
+        self.frames = frames
+        self.dets = []
+        self.failed = False
+
+class DetectorServer:
+    """
+    Serves the detector over TCP. A reader thread per connection queues the incoming requests, the batching
+    thread gathers frames of all connections into one detector batch, released when max_batch_size frames
+    are waiting or max_wait seconds after the first one arrived, and sends every request its detections.
+    A request with more frames than max_batch_size is split over several batches. Malformed requests, requests
+    with frames larger than max_side or more than max_frames frames, checked before anything is allocated,
+    and requests the detector fails on close the connection of their client only.
+
+    Args:
+        detector (Detect): Detect object
+        host (str): address to bind
+        port (int): port to bind, 0 picks a free port
+        stride (int): model stride the image sides of the frames must be a multiple of
+        max_side (int): largest image side accepted, the largest detector input of the streams
+        max_frames (int): largest number of frames accepted in a request, None for 4 x max_batch_size
+
+    Attributes:
+        detector (Detect): Detect object
+        logger (logging): logger object
+        max_batch_size (int): maximum number of frames in a batch
+        max_wait (float): maximum time in seconds to wait for more frames once a frame is ready
+        stride (int): model stride the image sides of the frames must be a multiple of
+        max_side (int): largest image side accepted
+        max_frames (int): largest number of frames accepted in a request
+        requests (Queue): Request objects waiting for the detector
+        partial (tuple): (request, index of its first frame not batched yet) of a request split over batches, None otherwise
+        server_socket (socket): listening socket
+        port (int): port the server listens on
+    """
+    def __init__(self,detector,host="0.0.0.0",port=5050,stride=32,max_side=640,max_frames=None):
+        self.detector = detector
+        self.logger = detector.config.logger
+        self.max_batch_size = detector.data.batch_size
+        self.max_wait = detector.config.max_wait
+        self.stride = stride
+        self.max_side = max_side
+        self.max_frames = max_frames if max_frames is not None else 4 * self.max_batch_size
+        self.requests = queue.Queue()
+        self.partial = None
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen(15)
+        self.port = self.server_socket.getsockname()[1]
+
+    def serve(self):
+        """
+        Accepts clients forever, starts the batching thread first
+        """
+        threading.Thread(target=self.batch_loop, name="Detector_Batching", daemon=True).start()
+        self.logger.debug("Detector service listening on port %d", self.port)
+        while True:
+            connection, address = self.server_socket.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.logger.debug("Detector service client connected from %s", address)
+            threading.Thread(target=self.read_loop, args=(connection,), daemon=True).start()
+
+    def read_loop(self,connection):
+        """queues the requests of a connection until it closes"""
+        try:
+            while True:
+                frames,request_id = recv_frames(connection,self.stride,self.max_side,self.max_frames)
+                self.requests.put(Request(connection,request_id,frames))
+        except ValueError as err:
+            self.logger.warning("Detector service rejected a request: %s", err)
+        except (ConnectionError, OSError) as err:
+            self.logger.debug("Detector service client disconnected: %s", err)
+        connection.close()
+
+    def next_batch(self):
+        """Blocks until a batch is ready
+
+        Returns:
+            batch (list): (request, start, end) frame slices of the requests in the batch
+        """
+        batch,count,deadline = [],0,None
+        while count < self.max_batch_size:
+            if self.partial is None:
+                try:
+                    request = self.requests.get(timeout=None if deadline is None else max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                self.partial = (request,0)
+            request,start = self.partial
+            end = min(len(request.frames),start + self.max_batch_size - count)
+            batch.append((request,start,end))
+            count += end - start
+            self.partial = (request,end) if end < len(request.frames) else None
+            if deadline is None:
+                deadline = time.time() + self.max_wait
+        return batch
+
+    def detect(self,batch):
+        """runs the detector on a batch, when it fails every request is retried on its own to find the offending ones
+
+        Args:
+            batch (list): (request, start, end) frame slices of the requests
+
+        Returns:
+            dets (list): detections of the frames of every slice, None for the slices the detector failed on
+        """
+        frames = [frame for request,start,end in batch for frame in request.frames[start:end]]
+        try:
+            dets = self.detector.detect(frames)
+        except Exception as err:
+            if len(batch) == 1:
+                self.logger.error("Detector service failed on request %d: %r", batch[0][0].request_id, err)
+                return [None]
+            return [self.detect([part])[0] for part in batch]
+        out,ind = [],0
+        for request,start,end in batch:
+            out.append(dets[ind:ind + end - start])
+            ind += end - start
+        return out
+
+    def batch_loop(self):
+        """
+        Runs the detector on the batched requests and sends back the responses
+        """
+        while True:
+            batch = [part for part in self.next_batch() if not part[0].failed]
+            if not batch:
+                continue
+            for (request,start,end),dets in zip(batch,self.detect(batch)):
+                if dets is None:
+                    request.failed = True
+                    try:
+                        request.connection.shutdown(socket.SHUT_RDWR)  # the reader thread sees the close and releases the connection
+                    except OSError:
+                        pass
+                    continue
+                request.dets += dets
+                if end < len(request.frames):
+                    continue
+                try:
+                    send_dets(request.connection,request.dets,request.request_id)
+                except OSError as err:
+                    self.logger.debug("Detector service failed to respond: %s", err)
+
+class RemoteDetector:
+    """
+    Client of DetectorServer, sends frames and waits for their detections
+
+    Args:
+        address (tuple): (host, port) of the detector service
+        timeout (float): socket timeout in seconds
+
+    Attributes:
+        sock (socket): connected socket
+        request_id (int): id of the last request
+    """
+    def __init__(self,address,timeout=30.0):
+        self.sock = socket.create_connection(address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.request_id = 0
+
+    def detect(self,frames):
+        """
+        Args:
+            frames (list): frames to detect on
+
+        Returns:
+            dets (list): (n, 6) detections of every frame
+        """
+        self.request_id = (self.request_id + 1) % (1 << 32)
+        send_frames(self.sock,frames,self.request_id)
+        dets,request_id = recv_dets(self.sock)
+        if request_id != self.request_id:
+            raise ConnectionError("Response %d does not match request %d" % (request_id, self.request_id))
+        return dets
+
+    def close(self):
+        self.sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the detector as a TCP service shared by several edge boxes")
+    parser.add_argument('--config', default="configfile.ini", help="path to config file")
+    opt = parser.parse_args()
+    from .detect import get_detect_object  # the detector and its models are only loaded by the service
+    from .frame_transform import max_input_size
+    config = get_config(global_var,opt.config)
+    detector = get_detect_object(global_var,opt.config)
+    detector.warmup()
+    DetectorServer(detector,config.service_host,config.service_port,max_side=max_input_size(config)).serve()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import torch
+import onnx
+
+from .models.experimental import End2End, attempt_load
+from .config_parser import get_config
+from .storage import global_var
+
+def export_onnx(weights,file=None,img_size=640,opset=12,dynamic=True,nms=None,classes=None):
+    """Exports YOLOv5 weights to ONNX, with the stride and class names as metadata for DetectMultiBackend.
+    With nms the graph also filters the confidences and runs NMS, it outputs the final (n, 7)
+    [x1, y1, x2, y2, conf, cls, image] detections of the batch instead of the raw predictions.
+
+    Args:
+        weights (str): path to the PyTorch weights
+        file (str): path to the ONNX model, defaults to weights with the .onnx suffix, or _end2end.onnx with nms
+        img_size (int): input size used to trace the model
+        opset (int): ONNX opset version, at least 11 with nms
+        dynamic (bool): dynamic batch size and input shape
+        nms (tuple): (confidence threshold, IoU threshold, maximum detections per image) baked into the graph, None to export raw predictions
+        classes (list): class ids kept in the end-to-end graph, the other class outputs are pruned from the Detect layer, None for all classes
+
+    Returns:
+        file (str): path to the ONNX model
+    """
+    file = file or os.path.splitext(weights)[0] + ("_end2end.onnx" if nms else ".onnx")
+    model = attempt_load(weights, device=torch.device('cpu'))
+    head = model.model[-1]  # Detect
+    head.inplace = False
+    head.onnx_dynamic = dynamic
+    head.export = True
+    stride, names = int(max(model.stride)), model.names
+    if nms:
+        if classes:
+            head.prune(classes)
+        model = End2End(model, *nms, classes=classes).eval()
+    im = torch.zeros(1, 3, img_size, img_size)
+    model(im)  # dry run builds the grids
+    output = {0: 'detections'} if nms else {0: 'batch', 1: 'anchors'}
+    torch.onnx.export(model, im, file, opset_version=opset, do_constant_folding=True,
+                      input_names=['images'], output_names=['output'],
+                      dynamic_axes={'images': {0: 'batch', 2: 'height', 3: 'width'}, 'output': output} if dynamic else None)
+    model_onnx = onnx.load(file)
+    for k,v in {'stride': stride, 'names': names, 'end2end': bool(nms)}.items():
+        meta = model_onnx.metadata_props.add()
+        meta.key, meta.value = k, str(v)
+    onnx.save(model_onnx, file)
+    return file
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports the detector weights to ONNX")
+    parser.add_argument('--config', default="configfile.ini", help="path to config file")
+    parser.add_argument('--weights', default=None, help="PyTorch weights, defaults to WEIGHTS of the config")
+    parser.add_argument('--output', default=None, help="ONNX model, defaults to the weights with the .onnx suffix")
+    parser.add_argument('--end2end', action='store_true', help="include NMS with CONFIDENCE_THRESHOLD, IoU_THRESHOLD and CLASSES of the config in the graph")
+    opt = parser.parse_args()
+    config = get_config(global_var,opt.config)
+    nms = (config.conf_thres, config.iou_thres, 300) if opt.end2end else None
+    file = export_onnx(opt.weights or config.detector_weights_file, opt.output, config.img_size, nms=nms, classes=config.classes)
+    print("Exported", file)
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@ import torch
 import torchvision
 from scipy.stats import multivariate_normal
 
+from .trace_cache import load_traced
+
 def get_gaussian_mask():
 	"""generates gaussian mask
 
@@ -29,11 +31,15 @@ class Encoder():
 	"""
 	Features for each detected object are returned using a siamese network.
 	"""
-	def __init__(self,device,wt_path=None):
+	def __init__(self,device,wt_path=None,cache_dir=None,logger=None):
 		#loading this encoder is slow, should be done only once.
 		self.device = device
-		self.encoder = torch.load(wt_path,map_location=torch.device(self.device))			
-		self.encoder = self.encoder.eval()
+		build = lambda: torch.load(wt_path,map_location=torch.device(self.device)).eval()
+		if cache_dir is not None:
+			#traced once per weights file, later starts load the trace instead of unpickling the model
+			self.encoder = load_traced(wt_path,(3,128,128),build,torch.device(self.device),cache_dir,"encoder",logger,method="forward_once")
+		else:
+			self.encoder = build()
 		print("Deep sort model loaded from path: ", wt_path)
 		self.gaussian_mask = get_gaussian_mask().to(self.device)
 
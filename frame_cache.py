@@ -0,0 +1,93 @@
+import hashlib
+import numpy as np
+
+class ResultCache:
+    """
+    Per stream cache of the last detections keyed on a digest of the exact frame bytes.
+    Frozen cameras and duplicate frames from cv2.VideoCapture.read() have the same digest,
+    so their detections are reused instead of joining the detector batch. Any pixel change,
+    a vehicle moving by one pixel included, is a miss. Detections are reused for at most
+    max_reuse frames in a row, then the frame goes through the detector again.
+    An alarm is logged once the camera hands over frozen_alarm identical frames in a row.
+
+    Args:
+        config (ParseConfig): ParseConfig Object
+        arm_id (str): stream id
+
+    Attributes:
+        logger (logging): logger object
+        arm_id (str): stream id
+        max_reuse (int): maximum number of consecutive frames served from the cache before detection is forced
+        frozen_alarm (int): number of consecutive identical frames after which the camera is reported frozen
+        key (bytes): digest of the last frame looked up or detected
+        candidate (bytes): digest of the last frame looked up
+        det (numpy array): cached detections
+        hits (int): number of consecutive identical frames
+        reused (int): number of consecutive frames served from the cache since the last detection
+        total_hits (int): number of frames served from the cache
+    """
+    def __init__(self,config,arm_id):
+        self.logger = config.logger
+        self.arm_id = arm_id
+        self.max_reuse = config.cache_max_reuse
+        self.frozen_alarm = config.cache_frozen_alarm
+        self.key = None
+        self.candidate = None
+        self.det = None
+        self.hits = 0
+        self.reused = 0
+        self.total_hits = 0
+
+    def frame_hash(self,frame):
+        """digest of the frame shape and pixels
+
+        Args:
+            frame (numpy array): detector input of the stream
+
+        Returns:
+            key (bytes): 128 bit digest
+        """
+        digest = hashlib.blake2b(str(frame.shape).encode(),digest_size=16)
+        digest.update(np.ascontiguousarray(frame))
+        return digest.digest()
+
+    def lookup(self,frame):
+        """checks whether the frame is identical to the cached one and its detections may be reused
+
+        Args:
+            frame (numpy array): detector input of the stream
+
+        Returns:
+            hit (bool): True if the cached detections belong to the frame
+        """
+        self.candidate = self.frame_hash(frame)
+        identical = self.key is not None and self.candidate == self.key
+        self.key = self.candidate
+        if not identical:
+            if self.hits >= self.frozen_alarm:
+                self.logger.warning("%s camera recovered after %d frozen frames", self.arm_id, self.hits)
+            self.hits = 0
+            return False
+        self.hits += 1
+        if self.hits == self.frozen_alarm:
+            self.logger.warning("%s camera frozen, %d identical frames in a row", self.arm_id, self.hits)
+        if self.reused >= self.max_reuse:
+            return False
+        self.reused += 1
+        self.total_hits += 1
+        return True
+
+    def reserve(self):
+        """keys the cache on the last frame looked up before its detections are known,
+        in temporal batching the following frames of the window are looked up against it
+        """
+        self.key = self.candidate
+        self.reused = 0
+
+    def fill(self,det):
+        """stores the detections of the reserved frame
+
+        Args:
+            det (numpy array): detections of the frame
+        """
+        self.det = det.copy()
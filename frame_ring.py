@@ -0,0 +1,87 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+HEADER_DIMS = 4
+
+class FrameRing:
+    """
+    Ring of preallocated frame slots in shared memory for a single stream.
+    The tracking process writes a frame into the next slot in place and only the slot index
+    is sent through the queue, the detector maps the slot back to a numpy array without unpickling.
+
+    Args:
+        slots(int): number of frame slots in the ring
+        frame_shape(tuple): largest frame shape a slot can hold, ex: (640,640,3)
+        name(str): name of an existing ring to attach to, a new ring is created when None
+
+    Attributes:
+        slots(int): number of frame slots in the ring
+        frame_shape(tuple): largest frame shape a slot can hold
+        slot_size(int): number of bytes in a slot
+        owner(bool): True if this instance created the shared memory and has to unlink it
+        shm(SharedMemory): shared memory block holding the header and the frame slots
+        header(numpy array): per slot ndim followed by the frame shape
+        data(numpy array): frame slots, one row of slot_size bytes per slot
+        index(int): next slot to be written
+    """
+    def __init__(self, slots=2, frame_shape=(640,640,3), name=None):
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        self.slot_size = int(np.prod(self.frame_shape))
+        header_size = slots * HEADER_DIMS * np.dtype(np.int32).itemsize
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_size + slots * self.slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.header = np.ndarray((slots, HEADER_DIMS), dtype=np.int32, buffer=self.shm.buf)
+        self.data = np.ndarray((slots, self.slot_size), dtype=np.uint8, buffer=self.shm.buf, offset=header_size)
+        self.index = 0
+
+    def __getstate__(self):
+        return self.slots, self.frame_shape, self.shm.name
+
+    def __setstate__(self, state):
+        slots, frame_shape, name = state
+        self.__init__(slots, frame_shape, name)
+
+    def write(self, frame):
+        """copies the frame into the next free slot
+
+        Args:
+            frame (numpy array): uint8 frame, at most frame_shape in size
+
+        Returns:
+            slot (int): index of the slot holding the frame
+        """
+        if frame.size > self.slot_size or frame.ndim >= HEADER_DIMS:
+            raise ValueError(f"Frame of shape {frame.shape} does not fit in a ring slot of shape {self.frame_shape}")
+        slot = self.index
+        self.index = (self.index + 1) % self.slots
+        np.copyto(self.data[slot, :frame.size].reshape(frame.shape), frame, casting='unsafe')
+        self.header[slot, 0] = frame.ndim
+        self.header[slot, 1:frame.ndim + 1] = frame.shape
+        return slot
+
+    def read(self, slot):
+        """maps a slot to a numpy array without copying
+
+        Args:
+            slot (int): index of the slot
+
+        Returns:
+            frame (numpy array): view of the frame stored in the slot
+        """
+        ndim = self.header[slot, 0]
+        shape = tuple(int(dim) for dim in self.header[slot, 1:ndim + 1])
+        return self.data[slot, :int(np.prod(shape))].reshape(shape)
+
+    def close(self):
+        """
+        Releases the shared memory, the owner also unlinks it
+        """
+        self.header = None
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
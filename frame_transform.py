@@ -0,0 +1,211 @@
+import math
+from collections import deque
+import cv2
+import numpy as np
+
+from .utils.augmentations import letterbox
+from .utils.general import scale_coords
+
+# frames are resized to FRAME_SIZE x FRAME_SIZE, zone dimensions are defined in this resolution
+FRAME_SIZE = 640
+
+def max_input_size(config):
+    """
+    Args:
+        config (ParseConfig): ParseConfig Object
+
+    Returns:
+        size (int): largest side of a frame any stream sends to the detector
+    """
+    return max([FRAME_SIZE, config.img_size, config.auto_sizes[-1]] + list(config.image_size.values()))
+
+class InputTransform:
+    """
+    Builds the detector input of a stream from its frame and maps the detections back to frame coordinates.
+    With a region of interest only the stride aligned window around the union of the zone polygons,
+    plus a margin, is sent to the detector.
+    In rect mode the raw camera frame, or its region of interest, is letterboxed to the smallest stride aligned
+    rectangle of img_size instead of being stretched to a square, e.g. 1920x1080 becomes 640x384. A region of
+    interest is scaled like the full frame and only padded to the stride, so it stays smaller than the full input.
+    Otherwise the frame is scaled by img_size / FRAME_SIZE. In auto mode img_size is picked from the
+    observed box sizes, the smallest of auto_sizes that keeps the small vehicles above auto_min_box pixels.
+
+    Args:
+        config (ParseConfig): ParseConfig Object
+        arm_id (str): stream id
+        stride (int): model stride, the detector input is a multiple of it
+
+    Attributes:
+        logger (logging): logger object
+        arm_id (str): stream id
+        stride (int): model stride
+        roi (tuple): (x1, y1, x2, y2) window of the frame sent to the detector, None for the full frame
+        rect (bool): letterbox the raw frame to a stride aligned rectangle
+        auto (bool): pick img_size from the observed box sizes
+        img_size (int): detector input size of the stream, FRAME_SIZE sends the frame unscaled
+        reduced (bool): load shedding, send the next smaller of auto_sizes than img_size
+        auto_sizes (list): input sizes the auto mode picks from, ascending
+        auto_min_box (int): smallest box side in pixels of the detector input the auto mode keeps
+        auto_interval (int): number of detected frames between input size decisions
+        box_sizes (deque): shortest side of the recently detected boxes in frame coordinates
+        detected (int): number of detected frames
+        shapes (tuple): (detector input shape, raw window shape, raw window offset, raw frame shape, (ratio, padding)) of the last rect input
+        scale (tuple): (x, y) scale from frame to detector input of the last input, None when unscaled
+        gain (float): smallest scale from frame to detector input of the last input
+    """
+    def __init__(self,config,arm_id,stride=32):
+        self.logger = config.logger
+        self.arm_id = arm_id
+        self.stride = stride
+        self.roi = None
+        self.rect = config.rect
+        self.auto = config.image_size[arm_id] == 0
+        self.auto_sizes = config.auto_sizes
+        self.auto_min_box = config.auto_min_box
+        self.auto_interval = config.auto_interval
+        self.img_size = self.auto_sizes[-1] if self.auto else config.image_size[arm_id]
+        self.reduced = False
+        self.box_sizes = deque(maxlen=1000)
+        self.detected = 0
+        self.shapes = None
+        self.scale = None
+        self.gain = 1.0
+        if config.roi[arm_id] is not None:
+            self.roi = self.get_roi(config.zones[arm_id],config.roi[arm_id])
+
+    def get_roi(self,zones,margin):
+        """stride aligned window around the union of the zone polygons
+
+        Args:
+            zones (dict): keys as zone ids and values as zone dimensions
+            margin (int): pixels added around the polygons
+
+        Returns:
+            roi (tuple): (x1, y1, x2, y2) window in frame coordinates
+        """
+        xs = [x for dims in zones.values() for x in dims[0::2]]
+        ys = [y for dims in zones.values() for y in dims[1::2]]
+        x1,x2 = self.align(min(xs) - margin, max(xs) + margin)
+        y1,y2 = self.align(min(ys) - margin, max(ys) + margin)
+        return x1,y1,x2,y2
+
+    def align(self,low,high):
+        """grows the range [low, high) to a multiple of stride inside the frame
+
+        Returns:
+            low, high (tuple): aligned range
+        """
+        low,high = max(int(low),0),min(int(math.ceil(high)),FRAME_SIZE)
+        size = min(int(math.ceil((high - low) / self.stride)) * self.stride,FRAME_SIZE)
+        low = min(low,FRAME_SIZE - size)
+        return low,low + size
+
+    def input_size(self):
+        """
+        Returns:
+            size (int): detector input size of the next frame
+        """
+        if self.reduced:
+            return next((size for size in reversed(self.auto_sizes) if size < self.img_size),self.img_size)
+        return self.img_size
+
+    def apply(self,frame,raw=None):
+        """detector input for a frame
+
+        Args:
+            frame (numpy array): FRAME_SIZE x FRAME_SIZE frame
+            raw (numpy array): frame as read from the stream, letterboxed in rect mode
+
+        Returns:
+            image (numpy array): frame or region of interest sent to the detector
+        """
+        if self.rect and raw is not None:
+            return self.letterbox(raw)
+        if self.roi is not None:
+            x1,y1,x2,y2 = self.roi
+            frame = frame[y1:y2,x1:x2]
+        self.scale = None
+        self.gain = 1.0
+        img_size = self.input_size()
+        if img_size == FRAME_SIZE:
+            return frame
+        h,w = frame.shape[:2]
+        size = [max(int(round(side * img_size / FRAME_SIZE / self.stride)) * self.stride,self.stride) for side in (w,h)]
+        self.scale = (size[0] / w,size[1] / h)
+        self.gain = min(self.scale)
+        return cv2.resize(frame,tuple(size),interpolation=cv2.INTER_AREA if img_size < FRAME_SIZE else cv2.INTER_LINEAR)
+
+    def letterbox(self,raw):
+        """letterboxes the raw frame, or its region of interest, to a stride aligned rectangle
+
+        Args:
+            raw (numpy array): frame as read from the stream
+
+        Returns:
+            image (numpy array): letterboxed detector input
+        """
+        h,w = raw.shape[:2]
+        x1,y1 = 0,0
+        if self.roi is not None:
+            x1,y1 = int(self.roi[0] * w / FRAME_SIZE),int(self.roi[1] * h / FRAME_SIZE)
+            x2,y2 = int(math.ceil(self.roi[2] * w / FRAME_SIZE)),int(math.ceil(self.roi[3] * h / FRAME_SIZE))
+            raw = raw[y1:y2,x1:x2]
+        size = self.input_size()
+        if self.roi is None:
+            image,ratio,pad = letterbox(raw,size,stride=self.stride,auto=True)
+        else:
+            # the window keeps the scale of the full frame letterbox instead of being blown up to size
+            r = size / max(h,w)
+            window = cv2.resize(raw,(max(int(round(raw.shape[1] * r)),1),max(int(round(raw.shape[0] * r)),1)),
+                                interpolation=cv2.INTER_AREA if r < 1 else cv2.INTER_LINEAR)
+            new_shape = tuple(int(math.ceil(side / self.stride)) * self.stride for side in window.shape[:2])
+            image,_,pad = letterbox(window,new_shape,stride=self.stride,auto=False,scaleup=False)
+            ratio = (window.shape[1] / raw.shape[1],window.shape[0] / raw.shape[0])
+        self.shapes = (image.shape[:2],raw.shape[:2],(x1,y1),(h,w),(ratio,pad))
+        self.gain = ratio[0] * min(w,h) / FRAME_SIZE
+        return image
+
+    def restore(self,det):
+        """maps detections of the detector input back to frame coordinates in place
+
+        Args:
+            det (numpy array): predictions of the detector input
+
+        Returns:
+            det (numpy array): predictions in frame coordinates
+        """
+        if not len(det):
+            return det
+        if self.shapes is not None:
+            image_shape,window_shape,offset,(h,w),ratio_pad = self.shapes
+            scale_coords(image_shape,det[:, :4],window_shape,ratio_pad)
+            det[:, [0, 2]] = (det[:, [0, 2]] + offset[0]) * (FRAME_SIZE / w)
+            det[:, [1, 3]] = (det[:, [1, 3]] + offset[1]) * (FRAME_SIZE / h)
+            return det
+        if self.scale is not None:
+            det[:, [0, 2]] /= self.scale[0]
+            det[:, [1, 3]] /= self.scale[1]
+        if self.roi is not None:
+            det[:, [0, 2]] += self.roi[0]
+            det[:, [1, 3]] += self.roi[1]
+        return det
+
+    def observe(self,det):
+        """records the box sizes of a detected frame and, in auto mode, picks the input size every auto_interval frames
+
+        Args:
+            det (numpy array): predictions in frame coordinates
+        """
+        if not self.auto:
+            return
+        if len(det):
+            self.box_sizes.extend(np.minimum(det[:, 2] - det[:, 0],det[:, 3] - det[:, 1]).tolist())
+        self.detected += 1
+        if self.detected % self.auto_interval or not self.box_sizes:
+            return
+        # box side in detector input pixels scales linearly with the input size
+        small = np.percentile(self.box_sizes,10) * self.gain / self.input_size()
+        size = next((size for size in self.auto_sizes if small * size >= self.auto_min_box),self.auto_sizes[-1])
+        if size != self.img_size:
+            self.logger.debug("%s detector input size %d -> %d, small vehicles are %.0f pixels", self.arm_id, self.img_size, size, small * size)
+            self.img_size = size
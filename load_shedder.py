@@ -0,0 +1,116 @@
+import torch.multiprocessing as mp
+
+class StreamLoad:
+    """
+    View of the load shedding state shared with a stream process. The stream records the
+    latency of every frame and reads the quality settings of the current level.
+
+    Args:
+        latency (Array): moving average end to end latency of every stream in seconds
+        level (Value): current load shedding level
+        index (int): index of the stream
+        levels (list): settings of every level
+
+    Attributes:
+        latency (Array): moving average end to end latency of every stream in seconds
+        level (Value): current load shedding level
+        index (int): index of the stream
+        levels (list): settings of every level
+    """
+    def __init__(self,latency,level,index,levels):
+        self.latency = latency
+        self.level = level
+        self.index = index
+        self.levels = levels
+
+    def record(self,seconds):
+        """
+        Args:
+            seconds (float): time from reading the frame to its zone assignment
+        """
+        previous = self.latency[self.index]
+        self.latency[self.index] = seconds if previous == 0 else 0.9 * previous + 0.1 * seconds
+
+    def settings(self):
+        """
+        Returns:
+            settings (dict): stride, reduced and reid_interval of the current level
+        """
+        return self.levels[self.level.value]
+
+class LoadShedder:
+    """
+    Steps the quality of all streams down when the detector falls behind and back up when headroom returns.
+    The level goes up one step when the slowest stream exceeds the latency budget or frames pile up
+    in the queues, and down one step when every stream is below headroom x budget with the queues drained.
+    Level 1 detects every stride-th frame, level 2 also drops the detector input one of the AUTO_SIZES,
+    level 3 also refreshes the deep sort features only every reid_interval frames.
+
+    Args:
+        config (ParseConfig): ParseConfig Object
+        queues (list): queues whose depth is watched
+
+    Attributes:
+        logger (logging): logger object
+        queues (list): queues whose depth is watched
+        budget (float): maximum end to end latency of a stream in seconds
+        max_depth (int): maximum number of items waiting in the queues
+        headroom (float): fraction of the budget below which quality steps back up
+        levels (list): settings of every level, level 0 is full quality
+        latency (Array): moving average end to end latency of every stream in seconds, 0 until measured
+        level (Value): current load shedding level
+    """
+    def __init__(self,config,queues):
+        self.logger = config.logger
+        self.queues = queues
+        self.budget = config.shed_latency_budget
+        self.max_depth = config.shed_max_queue_depth
+        self.headroom = config.shed_headroom
+        stride,reid_interval = config.shed_stride,config.shed_reid_interval
+        self.levels = [
+            {"stride": 1, "reduced": False, "reid_interval": 1},
+            {"stride": stride, "reduced": False, "reid_interval": 1},
+            {"stride": stride, "reduced": True, "reid_interval": 1},
+            {"stride": stride, "reduced": True, "reid_interval": reid_interval},
+        ]
+        self.latency = mp.Array('d',len(config.arms))
+        self.level = mp.Value('i',0)
+
+    def stream(self,index):
+        """
+        Args:
+            index (int): index of the stream
+
+        Returns:
+            load (StreamLoad): load shedding state of the stream
+        """
+        return StreamLoad(self.latency,self.level,index,self.levels)
+
+    def depth(self):
+        """
+        Returns:
+            depth (int): number of items waiting in the queues
+        """
+        depth = 0
+        for queue in self.queues:
+            try:
+                depth += queue.qsize()
+            except NotImplementedError:  # qsize is not available on macOS
+                pass
+        return depth
+
+    def update(self):
+        """
+        Moves the level one step according to the latency and queue depth, scheduled every SHEDDING INTERVAL seconds
+        """
+        latency = max(self.latency[:])
+        depth = self.depth()
+        level = self.level.value
+        if (latency > self.budget or depth > self.max_depth) and level < len(self.levels) - 1:
+            level += 1
+        elif latency < self.headroom * self.budget and depth <= self.max_depth // 2 and level > 0:
+            level -= 1
+        if level != self.level.value:
+            self.logger.debug("Load shedding level %d -> %d (%s), latency %.3fs of %.3fs budget, queue depth %d",
+                              self.level.value, level, self.levels[level], latency, self.budget, depth)
+            self.level.value = level
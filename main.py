@@ -5,30 +5,12 @@ import time
 import sys
 
 from .config_parser import get_config
-from .detect import run_detect
 from .socket_server import get_socketserver_object
 from .run_vehicle_tracking import vehicle_tracking
+from .detector_pool import DetectorPool
+from .load_shedder import LoadShedder
 from .storage import global_var
 
-def start_detector_process(send_queues,recv_queues,config,configfile,processes):
-    """run object detection on each stream
-
-    Args:
-        send_queues (dict): keys as stream ids and values as queue objects
-        recv_queues (dict): keys as stream ids and values as queue objects
-        config (ParseConfig): ParseConfig Object
-        configfile (str): configfile location
-        processes (dict): multi process dict
-    """
-    config.logger.debug("Starting detector process")
-    send,recv = [],[]
-    for s,q in zip(send_queues,recv_queues):
-        send.append(send_queues[s])
-        recv.append(recv_queues[q])
-    p = mp.Process(target = run_detect, args=(send,recv,configfile,))
-    processes["detector"] = p
-    p.start()
-
 class VehicleTracking:
     """
     VehicleTracking class, starts all the processes and threads.
@@ -41,6 +23,9 @@ class VehicleTracking:
         config( config object): parses config file and stores all the required data
         send_queues(dict): keys are arm_ids and values as Queue objects
         recv_queues(dict): keys are arm_ids and values as Queue objects
+        rings(dict): keys are arm_ids and values as FrameRing objects, empty when frames are pickled
+        detector_pool(DetectorPool): starts the detector workers and shards the streams across them
+        shedder(LoadShedder): steps the quality of the streams down when the detector falls behind, None when disabled
         socket_queue(Queue): used to transfer data to socket server
         server(SocketServer object): starts a server
         logger(itspelogger object): logger object
@@ -54,13 +39,15 @@ class VehicleTracking:
             print(err)
         self.configfile = configfile
         self.config = get_config(global_var,configfile)
-        self.send_queues = {}
-        self.recv_queues = {}
-        for ind,_ in enumerate(self.config.arms):
-            self.send_queues[ind] = mp.Queue()
-            self.recv_queues[ind] = mp.Queue()
+        self.detector_pool = DetectorPool(self.config,configfile)
+        self.send_queues = self.detector_pool.send_queues
+        self.recv_queues = self.detector_pool.recv_queues
+        self.rings = self.detector_pool.rings
         self.socket_queue = mp.Queue()
         self.server = get_socketserver_object(global_var,self.config,self.socket_queue)
+        self.shedder = None
+        if self.config.load_shedding:
+            self.shedder = LoadShedder(self.config,list(self.send_queues.values()) + [self.socket_queue])
         self.logger = self.config.logger
         self.threads = {}
         self.processes = {}
@@ -100,7 +87,8 @@ class VehicleTracking:
         else:
             for arm_id in stopped_processes:
                 del self.processes[arm_id]
-                self.start_vehicle_tracking_process(arm_id,self.configfile)
+                if not self.detector_pool.restart(arm_id,self.processes):
+                    self.start_vehicle_tracking_process(arm_id,self.configfile)
 
     def end_process(self):
         """
@@ -109,6 +97,14 @@ class VehicleTracking:
         self.logger.debug("Ending all processes")
         for _,process in self.processes.items():
             process.join()
+        self.close_rings()
+
+    def close_rings(self):
+        """
+        Releases the shared memory rings
+        """
+        self.detector_pool.close()
+        self.rings = {}
     
     def start_data_publish_thread(self):
         """
@@ -137,7 +133,10 @@ class VehicleTracking:
             configfile (str): config file
         """
         self.logger.debug("Starting vehicle_tracking process for %s", arm_id)
-        p = mp.Process(target = vehicle_tracking, args =(arm_id,configfile,self.send_queues[self.config.arms.index(arm_id)],self.recv_queues[self.config.arms.index(arm_id)],self.socket_queue,))
+        ind = self.config.arms.index(arm_id)
+        ready = None if self.config.remote is not None else self.detector_pool.ready
+        load = self.shedder.stream(ind) if self.shedder is not None else None
+        p = mp.Process(target = vehicle_tracking, args =(arm_id,configfile,self.send_queues[ind],self.recv_queues[ind],self.socket_queue,self.rings.get(ind),ready,load,))
         self.processes[arm_id] = p
         p.start()
 
@@ -146,19 +145,24 @@ class VehicleTracking:
         Starts all threads and processes.
         Schedules checks for the above started threads and process
         """
+        if self.config.remote is None:
+            self.detector_pool.start(self.processes)  # with REMOTE the streams use the detector service instead
         for arm_id in self.config.arms:
             self.start_vehicle_tracking_process(arm_id, self.configfile)
-        start_detector_process(self.send_queues,self.recv_queues,self.config,self.configfile,self.processes)
         self.start_data_publish_thread()
         self.start_socket_server_thread()
         schedule.every(self.config.check_freq).minutes.do(self.check_and_restart_process)
         schedule.every(self.config.check_freq).minutes.do(self.check_and_restart_threads)
+        schedule.every(self.config.rebalance_interval).seconds.do(self.detector_pool.rebalance)
+        if self.shedder is not None:
+            schedule.every(self.config.shed_interval).seconds.do(self.shedder.update)
         while True:
             try:
                 schedule.run_pending()
                 time.sleep(1)
             except KeyboardInterrupt:
                 # self.end_process()
+                self.close_rings()
                 sys.exit(0)
 
 if __name__ == '__main__':
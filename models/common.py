@@ -305,7 +305,7 @@ class Concat(nn.Module):
 
 class DetectMultiBackend(nn.Module):
     # YOLOv5 MultiBackend class for python inference on various backends
-    def __init__(self, weights='yolov5s.pt', device=torch.device('cpu'), dnn=False, data=None, fp16=False):
+    def __init__(self, weights='yolov5s.pt', device=torch.device('cpu'), dnn=False, data=None, fp16=False, options=None):
         # Usage:
         #   PyTorch:              weights = *.pt
         #   TorchScript:                    *.torchscript
@@ -318,6 +318,9 @@ class DetectMultiBackend(nn.Module):
         #   TensorFlow GraphDef:            *.pb
         #   TensorFlow Lite:                *.tflite
         #   TensorFlow Edge TPU:            *_edgetpu.tflite
+        # options (ONNX Runtime, OpenVINO): intra_op_threads, inter_op_threads, execution_mode ('sequential' or 'parallel'),
+        #   graph_optimization ('disable', 'basic', 'extended' or 'all'), io_buffers (outputs reused in rotation)
+        # end2end (ONNX Runtime, OpenVINO): models exported with NMS output final (n,7) [xyxy, conf, cls, image] detections
         from models.experimental import attempt_download, attempt_load  # scoped to avoid circular import
 
         super().__init__()
@@ -326,6 +329,9 @@ class DetectMultiBackend(nn.Module):
         w = attempt_download(w)  # download if not local
         fp16 &= (pt or jit or onnx or engine) and device.type != 'cpu'  # FP16
         stride, names = 32, [f'class{i}' for i in range(1000)]  # assign defaults
+        end2end = False  # NMS in the graph
+        options = options or {}
+        io_count, io_calls = max(options.get('io_buffers', 3), 1), {}  # preallocated outputs used in rotation, calls per input shape
         if data:  # assign class names (optional)
             with open(data, errors='ignore') as f:
                 names = yaml.safe_load(f)['names']
@@ -353,20 +359,40 @@ class DetectMultiBackend(nn.Module):
             check_requirements(('onnx', 'onnxruntime-gpu' if cuda else 'onnxruntime'))
             import onnxruntime
             providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if cuda else ['CPUExecutionProvider']
-            session = onnxruntime.InferenceSession(w, providers=providers)
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = options.get('intra_op_threads', 0)
+            session_options.inter_op_num_threads = options.get('inter_op_threads', 0)
+            session_options.execution_mode = {
+                'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+                'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL}[options.get('execution_mode', 'sequential')]
+            session_options.graph_optimization_level = {
+                'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+                'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+                'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+                'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL}[options.get('graph_optimization', 'all')]
+            session = onnxruntime.InferenceSession(w, sess_options=session_options, providers=providers)
+            io_bindings = {}  # input shape: [(IOBinding, output tensor)] reused in rotation
+            end2end = len(session.get_outputs()[0].shape) == 2  # (n,7) detections instead of (bs,n,no) predictions
             meta = session.get_modelmeta().custom_metadata_map  # metadata
             if 'stride' in meta:
                 stride, names = int(meta['stride']), eval(meta['names'])
         elif xml:  # OpenVINO
             LOGGER.info(f'Loading {w} for OpenVINO inference...')
             check_requirements(('openvino',))  # requires openvino-dev: https://pypi.org/project/openvino-dev/
-            from openvino.runtime import Core
+            from openvino.runtime import Core, Tensor
             ie = Core()
             if not Path(w).is_file():  # if not *.xml
                 w = next(Path(w).glob('*.xml'))  # get *.xml file from *_openvino_model dir
             network = ie.read_model(model=w, weights=Path(w).with_suffix('.bin'))
-            executable_network = ie.compile_model(network, device_name="CPU")  # device_name="MYRIAD" for Intel NCS2
+            ov_config = {}
+            if options.get('intra_op_threads'):
+                ov_config['INFERENCE_NUM_THREADS'] = str(options['intra_op_threads'])
+            if options.get('inter_op_threads'):
+                ov_config['NUM_STREAMS'] = str(options['inter_op_threads'])
+            executable_network = ie.compile_model(network, device_name="CPU", config=ov_config)  # device_name="MYRIAD" for Intel NCS2
             output_layer = next(iter(executable_network.outputs))
+            end2end = output_layer.get_partial_shape().rank.get_length() == 2
+            infer_requests = {}  # input shape: [InferRequest] reused in rotation
             meta = Path(w).with_suffix('.yaml')
             if meta.exists():
                 stride, names = self._load_metadata(meta)  # load metadata
@@ -448,12 +474,24 @@ class DetectMultiBackend(nn.Module):
             im = im.cpu().numpy()  # torch to numpy
             self.net.setInput(im)
             y = self.net.forward()
+        elif self.onnx and self.end2end:  # ONNX Runtime with NMS, the number of detections varies so the runtime allocates the output
+            y = self.session.run(None, {self.session.get_inputs()[0].name: im.cpu().numpy()})[0]
         elif self.onnx:  # ONNX Runtime
-            im = im.cpu().numpy()  # torch to numpy
-            y = self.session.run([self.session.get_outputs()[0].name], {self.session.get_inputs()[0].name: im})[0]
+            im = im.contiguous()  # bound in place
+            if im.shape not in self.io_bindings:
+                shape = self._onnx_output_shape(im)
+                self.io_bindings[im.shape] = [self._onnx_binding(im, shape) for _ in range(self.io_count)]
+            binding, y = self.io_bindings[im.shape][self._io_index(im.shape)]
+            binding.bind_input(self.session.get_inputs()[0].name, im.device.type, im.device.index or 0,
+                               np.float16 if im.dtype == torch.float16 else np.float32, tuple(im.shape), im.data_ptr())
+            self.session.run_with_iobinding(binding)
         elif self.xml:  # OpenVINO
-            im = im.cpu().numpy()  # FP32
-            y = self.executable_network([im])[self.output_layer]
+            if im.shape not in self.infer_requests:
+                self.infer_requests[im.shape] = [self.executable_network.create_infer_request() for _ in range(self.io_count)]
+            request = self.infer_requests[im.shape][self._io_index(im.shape)]
+            request.set_input_tensor(self.Tensor(im.cpu().contiguous().numpy(), shared_memory=True))  # FP32, no copy
+            request.infer()
+            y = torch.from_numpy(request.get_output_tensor(self.output_layer.index).data)
         elif self.engine:  # TensorRT
             assert im.shape == self.bindings['images'].shape, (im.shape, self.bindings['images'].shape)
             self.binding_addrs['images'] = int(im.data_ptr())
@@ -492,9 +530,37 @@ class DetectMultiBackend(nn.Module):
             y[..., :4] *= [w, h, w, h]  # xywh normalized to pixels
 
         if isinstance(y, np.ndarray):
-            y = torch.tensor(y, device=self.device)
+            y = torch.from_numpy(y)
+        y = y.to(self.device)
         return (y, []) if val else y
 
+    def _io_index(self, shape):
+        # next output buffer of the rotation of an input shape, every shape rotates on its own so a batch
+        # with several shapes never hands a shape the buffer its previous batch is still being read from
+        calls = self.io_calls.get(shape, 0)
+        self.io_calls[shape] = calls + 1
+        return calls % self.io_count
+
+    def _onnx_output_shape(self, im):
+        # dry run with a runtime allocated output to get the output shape for inputs shaped like im
+        binding = self.session.io_binding()
+        device = im.device.type, im.device.index or 0
+        name, output = self.session.get_inputs()[0].name, self.session.get_outputs()[0]
+        binding.bind_input(name, *device, np.float16 if im.dtype == torch.float16 else np.float32, tuple(im.shape), im.data_ptr())
+        binding.bind_output(output.name, *device)
+        self.session.run_with_iobinding(binding)
+        return tuple(binding.get_outputs()[0].shape())
+
+    def _onnx_binding(self, im, shape):
+        # ONNX Runtime IOBinding writing into a preallocated output of the given shape for inputs shaped like im
+        device = im.device.type, im.device.index or 0
+        output = self.session.get_outputs()[0]
+        half = output.type == 'tensor(float16)'
+        y = torch.empty(shape, dtype=torch.float16 if half else torch.float32, device=im.device)
+        binding = self.session.io_binding()
+        binding.bind_output(output.name, *device, np.float16 if half else np.float32, shape, y.data_ptr())
+        return binding, y
+
     def warmup(self, imgsz=(1, 3, 640, 640)):
         # Warmup model by running inference once
         warmup_types = self.pt, self.jit, self.onnx, self.engine, self.saved_model, self.pb
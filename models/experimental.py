@@ -7,6 +7,7 @@ import math
 import numpy as np
 import torch
 import torch.nn as nn
+import torchvision
 
 from models.common import Conv
 from utils.downloads import attempt_download
@@ -71,6 +72,46 @@ class Ensemble(nn.ModuleList):
         return y, None  # inference, train output
 
 
+class ORT_NMS(torch.autograd.Function):
+    # ONNX NonMaxSuppression, exported as the ONNX op and run with torchvision when called in PyTorch
+    @staticmethod
+    def forward(ctx, boxes, scores, max_output_boxes_per_class, iou_threshold, score_threshold):
+        # boxes(bs,n,4) xyxy, scores(bs,1,n) returns selected_indices(k,3) [image, class, box]
+        i = []
+        for b in range(boxes.shape[0]):
+            keep = (scores[b, 0] > score_threshold).nonzero()[:, 0]
+            j = keep[torchvision.ops.nms(boxes[b, keep], scores[b, 0, keep], float(iou_threshold))][:int(max_output_boxes_per_class)]
+            i.append(torch.stack((torch.full_like(j, b), torch.zeros_like(j), j), 1))
+        return torch.cat(i) if i else torch.zeros((0, 3), dtype=torch.int64)
+
+    @staticmethod
+    def symbolic(g, boxes, scores, max_output_boxes_per_class, iou_threshold, score_threshold):
+        return g.op('NonMaxSuppression', boxes, scores, max_output_boxes_per_class, iou_threshold, score_threshold)
+
+
+class End2End(nn.Module):
+    # YOLOv5 model with box decoding, confidence filtering and NMS in the graph
+    # Output detections(k,7) [x1, y1, x2, y2, conf, cls, image] of the whole batch, grouped by image
+    max_wh = 7680  # (pixels) class offset of the boxes, NMS runs per class like utils.general.non_max_suppression
+
+    def __init__(self, model, conf_thres=0.25, iou_thres=0.45, max_det=300, classes=None):
+        super().__init__()
+        self.model = model
+        self.register_buffer('max_det', torch.tensor([max_det]))
+        self.register_buffer('iou_thres', torch.tensor([iou_thres]))
+        self.register_buffer('conf_thres', torch.tensor([conf_thres]))
+        self.register_buffer('convert', torch.tensor([[1, 0, 1, 0], [0, 1, 0, 1], [-0.5, 0, 0.5, 0], [0, -0.5, 0, 0.5]]))
+        self.register_buffer('class_map', torch.tensor(classes if classes else list(range(model.model[-1].nc))).float())
+
+    def forward(self, x):
+        y = self.model(x)[0]  # (bs,n,5+nc) xywh, obj, cls
+        box = y[..., :4] @ self.convert  # xywh to xyxy
+        score, cls = (y[..., 5:] * y[..., 4:5]).max(2, keepdim=True)  # conf = obj_conf * cls_conf, best class only
+        i = ORT_NMS.apply(box + cls.float() * self.max_wh, score.transpose(1, 2), self.max_det, self.iou_thres, self.conf_thres)
+        b, k = i[:, 0], i[:, 2]
+        return torch.cat((box[b, k], score[b, k], self.class_map[cls[b, k, 0]][:, None], b[:, None].float()), 1)
+
+
 def attempt_load(weights, device=None, inplace=True, fuse=True):
     # Loads an ensemble of models weights=[a,b,c] or a single model weights=[a] or weights=a
     from models.yolo import Detect, Model
@@ -75,6 +75,18 @@ class Detect(nn.Module):
 
         return x if self.training else (torch.cat(z, 1),) if self.export else (torch.cat(z, 1), x)
 
+    def prune(self, classes):
+        # Keep only the output rows of the given class ids in the output convs, outputs become [xywh, obj, classes]
+        keep = [a * self.no + k for a in range(self.na) for k in list(range(5)) + [5 + c for c in classes]]
+        for i, m in enumerate(self.m):
+            conv = nn.Conv2d(m.in_channels, len(keep), 1).to(m.weight.device, m.weight.dtype)
+            conv.weight.data = m.weight.data[keep].clone()
+            conv.bias.data = m.bias.data[keep].clone()
+            self.m[i] = conv
+        self.nc = len(classes)
+        self.no = self.nc + 5
+        return self
+
     def _make_grid(self, nx=20, ny=20, i=0):
         d = self.anchors[i].device
         t = self.anchors[i].dtype
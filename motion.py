@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+
+class MotionGate:
+    """
+    Cheap per stream motion check used to skip the detector on static frames.
+    Frames are downsampled to a small grayscale image and compared with the last frame that went
+    through the detector, a frame is static when too few pixels changed.
+
+    Args:
+        config (ParseConfig): ParseConfig Object
+
+    Attributes:
+        threshold (int): grayscale difference above which a pixel counts as changed
+        min_area (float): fraction of changed pixels above which a frame has motion
+        max_skip (int): maximum number of consecutive skipped frames before detection is forced
+        size (int): width and height of the downsampled image
+        reference (numpy array): downsampled image of the last detected frame
+        since_detection (int): number of frames skipped since the last detection
+        frames (int): number of frames checked
+        skipped (int): number of frames skipped
+    """
+    def __init__(self,config):
+        self.threshold = config.motion_threshold
+        self.min_area = config.motion_min_area
+        self.max_skip = config.motion_max_skip
+        self.size = config.motion_size
+        self.reference = None
+        self.since_detection = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def is_static(self,frame):
+        """checks the frame against the last detected frame
+
+        Args:
+            frame (numpy array): detector input of the stream
+
+        Returns:
+            static (bool): True if the detector can be skipped for this frame
+        """
+        small = cv2.resize(frame,(self.size,self.size),interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(cv2.cvtColor(small,cv2.COLOR_BGR2GRAY),(3,3),0)
+        self.frames += 1
+        static = False
+        if self.reference is not None and self.since_detection < self.max_skip:
+            changed = np.count_nonzero(cv2.absdiff(small,self.reference) > self.threshold)
+            static = bool(changed < self.min_area * small.size)
+        if static:
+            self.skipped += 1
+            self.since_detection += 1
+        else:
+            self.reference = small
+            self.since_detection = 0
+        return static
@@ -0,0 +1,91 @@
+from threading import Thread
+import queue
+import time
+
+class Stage(Thread):
+    """
+    Runs one step of the detector in its own thread and hands the result to the next stage.
+    Stages are connected with queues of size one, so a stage works on batch N while the
+    previous stage prepares batch N+1 and the next stage finishes batch N-1.
+
+    Args:
+        name (str): name of the stage
+        fn (function): called with every item received from source
+        source (function): blocks until the next item is available, ex: get of the previous stage queue
+        out_queue (Queue): queue to send items to the next stage, None for the last stage
+
+    Attributes:
+        fn (function): step run by the stage
+        source (function): blocks until the next item is available
+        out_queue (Queue): queue to send items to the next stage
+        busy (float): seconds spent in fn since the last utilisation call, waiting for items is not counted
+        window_start (float): start of the current utilisation window
+    """
+    def __init__(self,name,fn,source,out_queue=None):
+        super().__init__(name=name,daemon=True)
+        self.fn = fn
+        self.source = source
+        self.out_queue = out_queue
+        self.busy = 0.0
+        self.window_start = time.time()
+
+    def run(self):
+        while True:
+            item = self.source()
+            t1 = time.time()
+            item = self.fn(item)
+            self.busy += time.time() - t1
+            if self.out_queue is not None:
+                self.out_queue.put(item)
+
+    def utilisation(self):
+        """fraction of time spent working since the last call
+
+        Returns:
+            utilisation (float): busy time divided by wall time
+        """
+        now = time.time()
+        utilisation = min(self.busy / max(now - self.window_start, 1e-9), 1.0)  # a call spanning windows is counted in the later one
+        self.busy = 0.0
+        self.window_start = now
+        return utilisation
+
+class Pipeline:
+    """
+    Chain of stages running concurrently
+
+    Args:
+        source (function): blocks until the next item for the first stage is available
+        steps (list): list of (name, function) tuples, each function takes the output of the previous one
+
+    Attributes:
+        stages (list): list of Stage objects
+    """
+    def __init__(self,source,steps):
+        self.stages = []
+        for n,(name,fn) in enumerate(steps):
+            out_queue = queue.Queue(maxsize=1) if n < len(steps) - 1 else None
+            self.stages.append(Stage(name,fn,source,out_queue))
+            if out_queue is not None:
+                source = out_queue.get
+
+    def start(self):
+        """
+        Starts all the stages
+        """
+        for stage in self.stages:
+            stage.start()
+
+    def is_alive(self):
+        """
+        Returns:
+            alive (bool): True if every stage is still running
+        """
+        return all(stage.is_alive() for stage in self.stages)
+
+    def utilisation(self):
+        """
+        Returns:
+            utilisation (dict): keys as stage names and values as fraction of time spent working
+        """
+        return {stage.name: stage.utilisation() for stage in self.stages}
@@ -0,0 +1,173 @@
+import argparse
+import os
+import time
+import numpy as np
+import torch
+import onnx
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+from .export import export_onnx
+from .models.common import DetectMultiBackend
+from .utils.general import non_max_suppression
+from .utils.metrics import ap_per_class, box_iou
+from .data_loader import sample_frames
+from .config_parser import get_config
+from .storage import global_var
+
+def to_input(frame):
+    """
+    Args:
+        frame (numpy array): BGR frame
+
+    Returns:
+        image (numpy array): 1 x 3 x h x w RGB image scaled to [0, 1]
+    """
+    return np.ascontiguousarray(frame[..., ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+
+class FrameReader(CalibrationDataReader):
+    """
+    Feeds the calibration frames to onnxruntime quantize_static
+
+    Args:
+        frames (list): calibration frames
+        input_name (str): name of the model input
+    """
+    def __init__(self,frames,input_name):
+        self.frames = iter(frames)
+        self.input_name = input_name
+
+    def get_next(self):
+        frame = next(self.frames, None)
+        return None if frame is None else {self.input_name: to_input(frame)}
+
+def head_nodes(file):
+    """nodes decoding the boxes after the output convolutions of the Detect layer, kept in FP32.
+    The graph is walked back from the model output and stops at the Conv nodes, so it does not
+    depend on the node names, which differ between torch exporters.
+
+    Args:
+        file (str): path to the ONNX model
+
+    Returns:
+        nodes (list): node names
+    """
+    model = onnx.load(file)
+    producers = {output: node for node in model.graph.node for output in node.output}
+    nodes,convs,visited = [],0,set()
+    pending = [output.name for output in model.graph.output]
+    while pending:
+        node = producers.get(pending.pop())
+        if node is None or id(node) in visited:
+            continue
+        visited.add(id(node))
+        if node.op_type == "Conv":
+            convs += 1
+            continue
+        nodes.append(node)
+        pending += list(node.input)
+    if not convs or not nodes or any(not node.name for node in nodes):
+        raise ValueError("Detect layer decode not found in %s, it would be quantized to INT8" % file)
+    return [node.name for node in nodes]
+
+def quantize(fp32,int8,frames,mode="static"):
+    """quantizes the ONNX model to INT8
+
+    Args:
+        fp32 (str): path to the FP32 ONNX model
+        int8 (str): path to the INT8 ONNX model
+        frames (list): calibration frames, used in static mode
+        mode (str): static quantizes weights and activations, dynamic only the weights
+    """
+    if mode == "dynamic":
+        quantize_dynamic(fp32, int8, weight_type=QuantType.QUInt8, nodes_to_exclude=head_nodes(fp32))
+        return
+    input_name = onnx.load(fp32).graph.input[0].name
+    quantize_static(fp32, int8, FrameReader(frames,input_name), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, nodes_to_exclude=head_nodes(fp32))
+
+@torch.no_grad()
+def evaluate(weights,frames,config):
+    """runs the model on the frames through DetectMultiBackend
+
+    Args:
+        weights (str): path to the model
+        frames (list): evaluation frames
+        config (ParseConfig): ParseConfig Object
+
+    Returns:
+        dets (list): list of predictions per frame
+        latency (float): mean inference time per frame in seconds
+        names (list): class names of the model
+    """
+    model = DetectMultiBackend(weights, data=config.data)
+    images = [torch.from_numpy(to_input(frame)) for frame in frames]
+    model(images[0])  # warmup
+    dets, elapsed = [], 0.0
+    for image in images:
+        t1 = time.time()
+        pred = model(image)
+        elapsed += time.time() - t1
+        dets.append(non_max_suppression(pred, config.conf_thres, config.iou_thres)[0])
+    return dets, elapsed / len(images), model.names
+
+def agreement(dets,targets,names):
+    """mAP of the predictions with the reference predictions as labels
+
+    Args:
+        dets (list): predictions per frame
+        targets (list): reference predictions per frame
+        names (list): class names
+
+    Returns:
+        map50, map (tuple): mAP@0.5 and mAP@0.5:0.95
+    """
+    iouv = torch.linspace(0.5, 0.95, 10)
+    stats = []
+    for det,target in zip(dets,targets):
+        correct = torch.zeros(det.shape[0], iouv.numel(), dtype=torch.bool)
+        if len(det) and len(target):
+            iou = box_iou(target[:, :4], det[:, :4])
+            for j,threshold in enumerate(iouv):
+                x = torch.where((iou >= threshold) & (target[:, 5:6] == det[:, 5]))  # IoU > threshold and classes match
+                if x[0].shape[0]:
+                    matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).numpy()
+                    matches = matches[matches[:, 2].argsort()[::-1]]
+                    matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+                    matches = matches[matches[:, 2].argsort()[::-1]]
+                    matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+                    correct[matches[:, 1].astype(int), j] = True
+        stats.append((correct, det[:, 4], det[:, 5], target[:, 5]))
+    stats = [torch.cat(x, 0).numpy() for x in zip(*stats)]
+    if not len(stats[3]) or not stats[0].any():
+        return 0.0, 0.0
+    ap = ap_per_class(*stats, names=dict(enumerate(names)))[5]
+    return ap[:, 0].mean(), ap.mean(1).mean()
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 quantization of the detector, calibrated on frames of the EMULATOR videos")
+    parser.add_argument('--config', default="configfile.ini", help="path to config file")
+    parser.add_argument('--weights', default=None, help="PyTorch weights, defaults to WEIGHTS of the config")
+    parser.add_argument('--output', default=None, help="INT8 ONNX model, defaults to the weights with the _int8.onnx suffix")
+    parser.add_argument('--mode', default="static", choices=["static","dynamic"], help="static also quantizes the activations")
+    parser.add_argument('--calibration-frames', type=int, default=100, help="number of frames used for calibration")
+    parser.add_argument('--eval-frames', type=int, default=50, help="number of frames used for the report")
+    opt = parser.parse_args()
+    config = get_config(global_var,opt.config)
+    weights = opt.weights or config.detector_weights_file
+    int8 = opt.output or os.path.splitext(weights)[0] + "_int8.onnx"
+    # per channel QDQ needs opset 13, written next to the weights without replacing an existing .onnx export
+    fp32 = export_onnx(weights, os.path.splitext(weights)[0] + "_fp32.onnx", img_size=config.img_size, opset=13)
+    quantize(fp32, int8, sample_frames(config,opt.calibration_frames) if opt.mode == "static" else [], opt.mode)
+
+    frames = sample_frames(config,opt.eval_frames,offset=0.5)
+    targets, base, names = evaluate(weights,frames,config)
+    print("%-40s %12s %10s %14s" % ("model", "latency(ms)", "mAP@0.5", "mAP@0.5:0.95"))
+    print("%-40s %12.1f %10s %14s" % (weights, base * 1000, "reference", "reference"))
+    for model in (fp32,int8):
+        dets, latency, _ = evaluate(model,frames,config)
+        map50, map = agreement(dets,targets,names)
+        print("%-40s %12.1f %10.3f %14.3f" % (model, latency * 1000, map50, map))
+    print("mAP is measured against the FP32 PyTorch detections. Use the INT8 model with BACKEND = ONNX and BACKEND_WEIGHTS = %s" % int8)
+
+if __name__ == '__main__':
+    main()
@@ -2,22 +2,32 @@ import os
 from datetime import datetime
 import time
 import cv2
+import numpy as np
 
 from .zone_assign import get_zoneassignment_object
 from .config_parser import get_config
 from .track import get_track_object
+from .frame_transform import InputTransform, FRAME_SIZE
+from .motion import MotionGate
+from .frame_cache import ResultCache
+from .detector_service import RemoteDetector
+from .data_loader import to_i420
 from .storage import global_var
 
-
-def put_in_batch_queue(frame,queue):
+def put_in_batch_queue(frame,queue,ring=None):
     """
-    Puts the frame into queue
+    Puts the frame into queue, if a shared memory ring is given the frame is written
+    into the ring and only the slot index is put into the queue
 
     Args:
-        frame (np.array): frame from a live stream
+        frame (np.array): frame from a live stream, or a list of frames sent as one message in temporal batching
         queue (Queue): send queue of respective arm id
+        ring (FrameRing): shared memory ring of respective arm id
     """
-    queue.put(frame)
+    if ring is not None:
+        queue.put([ring.write(image) for image in frame] if isinstance(frame,list) else ring.write(frame))
+    else:
+        queue.put(frame)
 
 def get_from_batch_queue(queue):
     """
@@ -29,9 +39,38 @@ def get_from_batch_queue(queue):
     det = queue.get()
     return det
 
-def execute_vehicle_tracking(path,arm_id, config, track, assign_zone, send_queue, recv_queue, socket_queue):
+def detect_frames(payloads,config,send_queue,recv_queue,ring=None,remote=None):
+    """
+    Detections of the frames of a window, in temporal batching they are sent to the detector as one message
+
+    Args:
+        payloads (list): detector inputs of the frames
+        config (NyanamConfig object): contains all the data from configfiles
+        send_queue (Queue): used to send frames to the detector process
+        recv_queue (Queue): receives detections from the detector process
+        ring (FrameRing): shared memory ring used to send frames, None to pickle frames through send_queue
+        remote (RemoteDetector object): detector service the frames are sent to instead of send_queue, None for the local detector
+
+    Returns:
+        dets (list): detections of every frame
+    """
+    if not payloads:
+        return []
+    if remote is not None:
+        return remote.detect(payloads)
+    if config.temporal_window > 1:
+        put_in_batch_queue(payloads,send_queue,ring)
+        return get_from_batch_queue(recv_queue)
+    put_in_batch_queue(payloads[0],send_queue,ring)
+    return [get_from_batch_queue(recv_queue)]
+
+def execute_vehicle_tracking(path,arm_id, config, track, assign_zone, transform, send_queue, recv_queue, socket_queue, ring=None, gate=None, cache=None, remote=None, load=None, window=1):
     """
-    Detects, Tracks and assigns zone for a given arm_id video or stream
+    Detects, Tracks and assigns zone for a given arm_id video or stream.
+    With a window of K frames, K consecutive frames are read and detected as one batch before
+    they are tracked in order. The cache, motion gate and stride decisions are made per frame
+    while reading, frames that skip the detector reuse the detections of the last detected frame
+    once it is back, so the results match reading one frame at a time.
 
     Args:
         path (str): video path or stream url
@@ -39,9 +78,16 @@ def execute_vehicle_tracking(path,arm_id, config, track, assign_zone, send_queue
         config (NyanamConfig object): contains all the data from configfiles
         track (Track object): used to track vehicles 
         assign_zone (ZoneAssignment object): assigns zone based on detection
+        transform (InputTransform object): builds the detector input and maps detections back to the frame
         send_queue (Queue): used to send frames to the detector process
         recv_queue (Queue): receives detections from the detector process
         socket_queue (Queue): vbv data is pushed into this queue, to publish data to all connected clients
+        ring (FrameRing): shared memory ring used to send frames, None to pickle frames through send_queue
+        gate (MotionGate object): skips the detector on static frames and reuses the last detections, None to detect every frame
+        cache (ResultCache object): reuses the detections of repeated frames, None to disable the cache
+        remote (RemoteDetector object): detector service the frames are sent to instead of send_queue, None for the local detector
+        load (StreamLoad object): load shedding state, None to always run at full quality
+        window (int): number of consecutive frames detected as one batch, 1 for live streams
 
     Returns:
         vehicle_count(int): count of all the vehicles in that respective video
@@ -51,42 +97,97 @@ def execute_vehicle_tracking(path,arm_id, config, track, assign_zone, send_queue
     fps = cap.get(cv2.CAP_PROP_FPS)
     print("FPS of input video is ,",fps)
     vehicle_count,frame_count = 0,0
-    while(cap.isOpened()):
-        ret, frame = cap.read()
-        if ret is False:
+    last_det = np.empty((0, 6))
+    last_report = time.time()
+    stop = False
+    while(cap.isOpened() and not stop):
+        settings = load.settings() if load is not None else None
+        if settings is not None:
+            transform.reduced = settings["reduced"]
+            track.reid_interval = settings["reid_interval"]
+        # source of the detections of every frame: index of its detector input, "cache" or "last"
+        frames,payloads = [],[]
+        while len(frames) < window:
+            ret, raw = cap.read()
+            if ret is False:
+                break
+            started = time.time()
+            frame = cv2.resize(raw,(FRAME_SIZE,FRAME_SIZE))
+            image = transform.apply(frame,raw)
+            if cache is not None and cache.lookup(image):
+                source = "cache"
+            elif gate is not None and gate.is_static(image):
+                source = "last"
+            elif settings is not None and (frame_count + len(frames)) % settings["stride"]:
+                source = "last"
+            else:
+                source = len(payloads)
+                payloads.append(to_i420(image) if config.frame_format == "I420" else image)
+                if cache is not None:
+                    cache.reserve()
+            frames.append((started,frame,cap.get(cv2.CAP_PROP_POS_FRAMES),source))
+        if not frames:
             break
-        frame = cv2.resize(frame,(640,640))
-        put_in_batch_queue(frame,send_queue)
-        det = get_from_batch_queue(recv_queue)
-        objects = track.process(det,frame,frame_number = cap.get(cv2.CAP_PROP_POS_FRAMES))
-        frame,counts = assign_zone.assign_zone(objects,frame,socket_queue)
-        vehicle_count += counts
-        frame_count += 1
-        if config.debug:
-            result = cv2.resize(frame,(480,480))
-            cv2.imshow(arm_id, result)
-            if cv2.waitKey(1) == ord('q'): break
+        dets = detect_frames(payloads,config,send_queue,recv_queue,ring,remote)
+        for started,frame,frame_number,source in frames:
+            if source == "cache":
+                det = cache.det.copy()
+            elif source == "last":
+                det = last_det.copy()
+            else:
+                det = transform.restore(dets[source])
+                transform.observe(det)
+                last_det = det.copy()
+                if cache is not None:
+                    cache.fill(det)
+            if time.time() - last_report > config.stats_interval:
+                if gate is not None:
+                    config.logger.debug("%s motion gate skipped %d of %d frames", arm_id, gate.skipped, gate.frames)
+                if cache is not None:
+                    config.logger.debug("%s result cache hit %d of %d frames", arm_id, cache.total_hits, frame_count + 1)
+                last_report = time.time()
+            objects = track.process(det,frame,frame_number = frame_number)
+            frame,counts = assign_zone.assign_zone(objects,frame,socket_queue)
+            vehicle_count += counts
+            frame_count += 1
+            if load is not None:
+                load.record(time.time() - started)
+            if config.debug:
+                result = cv2.resize(frame,(480,480))
+                cv2.imshow(arm_id, result)
+                if cv2.waitKey(1) == ord('q'):
+                    stop = True
+                    break
     cv2.destroyAllWindows()
     return vehicle_count,frame_count
 
-def vehicle_tracking(arm_id, configfile, send_queue,recv_queue,socket_queue):
+def vehicle_tracking(arm_id, configfile, send_queue,recv_queue,socket_queue,ring=None,ready=None,load=None):
     """
     Gets the config, zone_assignment and track object.
 
-    Based on model, it executes either emulator or real stream
+    Based on model, it executes either emulator or real stream.
+    Frames are sent only after every detector in ready has warmed up.
 
     """
     config = get_config(global_var,configfile)
+    if ready is not None:
+        for event in ready:
+            event.wait()
+        config.logger.debug("Detector ready, starting %s", arm_id)
     assign_zone = get_zoneassignment_object(global_var,arm_id,config)
     track = get_track_object(global_var,config)
+    transform = InputTransform(config,arm_id)
+    gate = MotionGate(config) if config.motion_gate else None
+    cache = ResultCache(config,arm_id) if config.result_cache else None
+    remote = RemoteDetector(config.remote) if config.remote is not None else None
     if config.model == "EMULATOR":
         video_dir_path = config.streams[arm_id] + "/" + arm_id
         print(os.listdir(video_dir_path))
         for video in  os.listdir(video_dir_path):
             t1 = time.time()
             video_path = video_dir_path + "/" + video
-            vehicle_count,frame_count = execute_vehicle_tracking(video_path,arm_id, config, track, assign_zone, send_queue, recv_queue, socket_queue)
+            vehicle_count,frame_count = execute_vehicle_tracking(video_path,arm_id, config, track, assign_zone, transform, send_queue, recv_queue, socket_queue, ring, gate, cache, remote, load, config.temporal_window)
             t2 = time.time()
             with open("counts.txt","a") as f:
                 f.write(str(datetime.now().strftime("%d-%m-%Y %H:%M:%S")) + "," +arm_id + "," + video + "," + str(vehicle_count)+","+str((t2-t1)/frame_count)+","+str((t2-t1))+","+str(frame_count)+"\n")
-    execute_vehicle_tracking(config.streams[arm_id],arm_id, config, track, assign_zone, send_queue, recv_queue, socket_queue)
\ No newline at end of file
+    execute_vehicle_tracking(config.streams[arm_id],arm_id, config, track, assign_zone, transform, send_queue, recv_queue, socket_queue, ring, gate, cache, remote, load)
\ No newline at end of file
@@ -0,0 +1,140 @@
+from queue import Empty
+import time
+
+POLL_INTERVAL = 0.001
+
+class BatchScheduler:
+    """
+    Collects frames from the stream queues into batches with a deadline.
+    A batch is released as soon as max_batch_size streams have a frame ready or max_wait seconds
+    after the first frame of the batch arrived, so a stalled stream never blocks the others.
+    When more streams are ready than fit in a batch, the slots go by weighted fair queuing:
+    every frame batched advances the virtual time of its stream by 1 / weight and the streams
+    with the lowest virtual finish time are served first. A stream with a target FPS is held
+    back once it runs ahead of its target, leaving its slots to the other streams.
+    In temporal batching a message holds a window of consecutive frames of one stream, the frames
+    of a window always go into the same batch and count as one frame each against the batch size.
+
+    Args:
+        send_queues (List): List of queues to receive frames from the streams
+        rings (List): List of shared memory rings of each stream, None when frames are pickled
+        max_batch_size (int): maximum number of frames in a batch, 0 to use the number of streams times window
+        max_wait (float): maximum time in seconds to wait for more frames once a frame is ready
+        assignment (Array): worker index of every stream when streams are sharded across workers, None to use all streams
+        worker (int): index of the worker this scheduler belongs to
+        weights (list): priority weight of every stream, None for equal weights
+        target_fps (list): maximum detection rate of every stream, 0 for no limit, None for no limits
+        window (int): number of frames in a message of a stream, 1 when every frame is sent on its own
+
+    Attributes:
+        send_queues (List): List of queues to receive frames from the streams
+        rings (List): List of shared memory rings of each stream
+        max_batch_size (int): maximum number of frames in a batch
+        max_wait (float): maximum time in seconds to wait for more frames once a frame is ready
+        assignment (Array): worker index of every stream
+        worker (int): index of the worker this scheduler belongs to
+        window (int): number of frames in a message of a stream
+        pending (dict): keys as stream index and values as (arrival time, frames of the message) not batched yet
+        weights (list): priority weight of every stream
+        target_fps (list): maximum detection rate of every stream, 0 for no limit
+        clock (float): virtual time of the scheduler, start time of the last frame batched
+        finish (list): virtual finish time of the last frame batched of every stream
+        start (dict): keys as stream index and values as virtual start time of the pending message
+        due (list): time the next frame of every stream with a target FPS may be batched
+        served (list): number of frames batched of every stream since the last report
+        report_time (float): time of the last report
+    """
+    def __init__(self,send_queues,rings=None,max_batch_size=0,max_wait=0.05,assignment=None,worker=0,weights=None,target_fps=None,window=1):
+        self.send_queues = send_queues
+        self.rings = rings if rings is not None else [None] * len(send_queues)
+        self.window = window
+        self.max_batch_size = max_batch_size if max_batch_size > 0 else len(send_queues) * window
+        self.max_wait = max_wait
+        self.assignment = assignment
+        self.worker = worker
+        self.pending = {}
+        self.weights = weights if weights is not None else [1.0] * len(send_queues)
+        self.target_fps = target_fps if target_fps is not None else [0.0] * len(send_queues)
+        self.clock = 0.0
+        self.finish = [0.0] * len(send_queues)
+        self.start = {}
+        self.due = [0.0] * len(send_queues)
+        self.served = [0] * len(send_queues)
+        self.report_time = time.time()
+
+    def streams(self):
+        """
+        Returns:
+            streams (list): index of the streams currently assigned to this worker
+        """
+        if self.assignment is None:
+            return list(range(len(self.send_queues)))
+        return [ind for ind,worker in enumerate(self.assignment[:]) if worker == self.worker]
+
+    def poll(self):
+        """
+        Moves the messages waiting in the stream queues to pending without blocking
+        """
+        for ind in self.streams():
+            if ind in self.pending:
+                continue
+            try:
+                message = self.send_queues[ind].get_nowait()
+            except Empty:
+                continue
+            frames = message if isinstance(message,list) else [message]
+            if self.rings[ind] is not None:
+                frames = [self.rings[ind].read(slot) for slot in frames]
+            self.pending[ind] = (time.time(),frames)
+            self.start[ind] = max(self.finish[ind],self.clock)  # a stream coming back from idle starts at the scheduler clock
+
+    def next_batch(self):
+        """Blocks until a batch is ready
+
+        Returns:
+            streams (list): stream index of every frame in the batch
+            frames (list): frames in the batch
+        """
+        deadline = None
+        while True:
+            self.poll()
+            now = time.time()
+            ready = [ind for ind in self.pending if now >= self.due[ind]]
+            full = max(min(self.max_batch_size,self.window * len([ind for ind in self.streams() if now >= self.due[ind]])),1)
+            if ready and deadline is None:
+                deadline = min(self.pending[ind][0] for ind in ready) + self.max_wait
+            if ready and (sum(len(self.pending[ind][1]) for ind in ready) >= full or now >= deadline):
+                break
+            time.sleep(POLL_INTERVAL if deadline is None else max(min(POLL_INTERVAL, deadline - now), 0))
+        streams,frames = [],[]
+        for ind in sorted(ready, key=lambda ind: (self.start[ind] + len(self.pending[ind][1]) / self.weights[ind], self.pending[ind][0])):
+            count = len(self.pending[ind][1])
+            if frames and len(frames) + count > self.max_batch_size:
+                continue
+            self.serve(ind,now,count)
+            streams += [ind] * count
+            frames += self.pending.pop(ind)[1]
+        return streams, frames
+
+    def serve(self,ind,now,count=1):
+        """advances the virtual time and the target FPS deadline of a stream whose message of count frames is batched"""
+        start = self.start.pop(ind)
+        self.finish[ind] = start + count / self.weights[ind]
+        self.clock = max(self.clock,start)
+        if self.target_fps[ind] > 0:
+            interval = count / self.target_fps[ind]
+            self.due[ind] = max(self.due[ind] + interval, now) if self.due[ind] else now + interval  # late frames keep the schedule
+        self.served[ind] += count
+
+    def report(self):
+        """achieved detection rate of the streams of this worker since the last report
+
+        Returns:
+            fps (dict): keys as stream index and values as (achieved FPS, target FPS)
+        """
+        now = time.time()
+        elapsed = max(now - self.report_time, 1e-6)
+        fps = {ind: (self.served[ind] / elapsed, self.target_fps[ind]) for ind in self.streams()}
+        self.served = [0] * len(self.send_queues)
+        self.report_time = now
+        return fps
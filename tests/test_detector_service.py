@@ -0,0 +1,91 @@
+import logging
+import socket
+import threading
+import numpy as np
+import pytest
+
+from ..data_loader import to_i420
+from ..detector_service import DetectorServer, RemoteDetector, HEADER, FRAME, MAGIC
+
+class FakeDetector:
+    """
+    Stands in for Detect, every frame gets one row holding its image height and width.
+    Frames whose first pixel is 255 make the detector fail like a real model error, frames whose
+    first pixel is 1 have no detections.
+    """
+    def __init__(self,batch_size=4):
+        self.config = type("Config", (), {"logger": logging.getLogger("test_detector_service"), "max_wait": 0.01})()
+        self.data = type("Data", (), {"batch_size": batch_size})()
+        self.batches = []
+
+    def detect(self,frames):
+        self.batches.append(len(frames))
+        if any(frame.flat[0] == 255 for frame in frames):
+            raise RuntimeError("model failed")
+        return [np.empty((0,6), dtype=np.float32) if frame.flat[0] == 1 else np.array([[frame.shape[0] if frame.ndim == 3 else frame.shape[0] * 2 // 3, frame.shape[1], 0, 0, 1, 0]], dtype=np.float32) for frame in frames]
+
+@pytest.fixture
+def server():
+    server = DetectorServer(FakeDetector(),"127.0.0.1",0)
+    threading.Thread(target=server.serve,daemon=True).start()
+    yield server
+    server.server_socket.close()
+
+def connect(server):
+    return RemoteDetector(("127.0.0.1",server.port),timeout=5.0)
+
+def test_round_trip(server):
+    client = connect(server)
+    frames = [np.zeros((64,96,3), dtype=np.uint8), to_i420(np.zeros((128,64,3), dtype=np.uint8))]
+    dets = client.detect(frames)
+    assert [det[0, :2].tolist() for det in dets] == [[64, 96], [128, 64]]
+    assert client.detect([np.ones((32,32,3), dtype=np.uint8)])[0].shape == (0, 6)
+    client.close()
+
+def test_oversized_request_is_split(server):
+    client = connect(server)
+    frames = [np.zeros((32 * (ind + 1),32,3), dtype=np.uint8) for ind in range(10)]
+    dets = client.detect(frames)
+    assert [det[0, 0] for det in dets] == [32 * (ind + 1) for ind in range(10)]
+    assert max(server.detector.batches) <= server.max_batch_size
+    client.close()
+
+@pytest.mark.parametrize("frames", [
+    [],
+    [np.zeros((100,100,3), dtype=np.uint8)],
+    [np.zeros((64,64,2), dtype=np.uint8)],
+    [np.zeros((64,64,3), dtype=np.uint8), np.zeros((0,64,3), dtype=np.uint8)],
+    [np.zeros((64,672,3), dtype=np.uint8)],
+    [np.zeros((32,32,3), dtype=np.uint8)] * 17,
+])
+def test_malformed_request_closes_only_its_connection(server,frames):
+    bad,good = connect(server),connect(server)
+    with pytest.raises((ConnectionError, OSError)):
+        bad.detect(frames)
+    assert len(good.detect([np.zeros((64,64,3), dtype=np.uint8)])) == 1
+    assert server.detector.batches == [1]
+    bad.close()
+    good.close()
+
+def test_detector_failure_closes_only_its_connection(server):
+    bad,good = connect(server),connect(server)
+    frame = np.zeros((64,64,3), dtype=np.uint8)
+    frame[0, 0] = 255
+    with pytest.raises((ConnectionError, OSError)):
+        bad.detect([frame])
+    assert len(good.detect([np.zeros((64,64,3), dtype=np.uint8)] * 2)) == 2
+    bad.close()
+    good.close()
+
+@pytest.mark.parametrize("header", [
+    HEADER.pack(MAGIC,65535,1),
+    HEADER.pack(MAGIC,1,1) + FRAME.pack(65535,65535,3),
+])
+def test_oversized_header_is_rejected_before_allocating(server,header):
+    sock = socket.create_connection(("127.0.0.1",server.port),timeout=5.0)
+    sock.sendall(header)
+    assert sock.recv(1) == b""  # closed by the server without waiting for the pixels
+    sock.close()
+    good = connect(server)
+    assert len(good.detect([np.zeros((64,64,3), dtype=np.uint8)])) == 1
+    good.close()
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import time
+import torch
+
+def weights_hash(weights):
+    """
+    Args:
+        weights (str): path to the weights file
+
+    Returns:
+        key (str): sha256 of the weights file content
+    """
+    sha = hashlib.sha256()
+    with open(weights, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def load_traced(weights,shape,build,device,cache_dir,name,logger,method="forward",key=None):
+    """Loads the TorchScript trace of a model from the cache, on a miss the model is built, traced and saved.
+    Traces are keyed by the weights hash, the input shape without the batch dimension and the device type.
+
+    Args:
+        weights (str): path to the weights file
+        shape (tuple): input shape without the batch dimension
+        build (function): returns the eager model, called only on a cache miss
+        device (torch.device): device the model runs on
+        cache_dir (str): folder of the cached traces
+        name (str): model name used in the file name and the logs
+        logger (logging): logger object
+        method (str): method of the model to trace
+        key (str): weights hash, computed when not given
+
+    Returns:
+        model (torch.jit.ScriptModule): traced model
+    """
+    key = key or weights_hash(weights)
+    path = os.path.join(cache_dir, "%s_%s_%s_%s.torchscript" % (name, key[:16], "x".join(str(s) for s in shape), device.type))
+    t1 = time.time()
+    if os.path.exists(path):
+        model = torch.jit.load(path, map_location=device)
+        logger.debug("%s warm start, loaded %s in %.2fs", name, path, time.time() - t1)
+        return model
+    model = build()
+    example = torch.zeros((2,) + tuple(shape), device=device)  # batch of 2 keeps the batch dimension dynamic
+    with torch.no_grad():
+        getattr(model, method)(example)  # dry run so shape dependent state such as grids is built before tracing
+        model = torch.jit.trace_module(model, {method: example})
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    model.save(tmp)
+    os.replace(tmp, path)  # detector workers may trace the same shape at once
+    logger.debug("%s cold start, traced and saved %s in %.2fs", name, path, time.time() - t1)
+    return model
+
+class TracedModel:
+    """
+    Runs a model through TorchScript traces loaded from the cache, one trace per input shape.
+    Traces bake in the shape dependent parts of the model such as the YOLOv5 grids, so a new input
+    shape loads or traces its own module on first use. The eager model is built only on a cache miss.
+
+    Args:
+        weights (str): path to the weights file
+        build (function): returns the eager model
+        device (torch.device): device the model runs on
+        cache_dir (str): folder of the cached traces
+        name (str): model name used in the file name and the logs
+        logger (logging): logger object
+
+    Attributes:
+        key (str): weights hash
+        modules (dict): keys as input shape without the batch dimension and values as traced models
+        model (torch.nn.Module): eager model, None until a trace is missing from the cache
+    """
+    def __init__(self,weights,build,device,cache_dir,name,logger):
+        self.weights = weights
+        self.build = build
+        self.device = device
+        self.cache_dir = cache_dir
+        self.name = name
+        self.logger = logger
+        self.key = weights_hash(weights)
+        self.modules = {}
+        self.model = None
+
+    def eager(self):
+        if self.model is None:
+            self.model = self.build()
+        return self.model
+
+    def __call__(self,x):
+        shape = tuple(x.shape[1:])
+        if shape not in self.modules:
+            self.modules[shape] = load_traced(self.weights, shape, self.eager, self.device, self.cache_dir, self.name, self.logger, key=self.key)
+        return self.modules[shape](x)
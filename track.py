@@ -1,4 +1,5 @@
 import numpy as np
+import torch
 from operator import itemgetter
 
 from .conventional_tracker.tracker2 import VehicleTracker
@@ -8,21 +9,35 @@ from .deep_sort.detection import Detection
 from .deep_sort.tracker import Tracker
 from .features import Encoder
 from .utils.torch_utils import select_device
+from .utils.metrics import box_iou
+
+# a box overlapping a box of the previous frame by at least REID_IOU reuses its deep sort feature between refreshes
+REID_IOU = 0.5
 
 class Track:
     """
     Different types of trackers are initiated
+
+    Attributes:
+        reid_interval (int): deep sort features of boxes overlapping the previous frame are computed every reid_interval frames, 1 for every frame
+        reid_frames (int): number of frames passed to the deep sort tracker
+        reid_boxes (numpy array): boxes of the previous deep sort frame, None before the first one
+        reid_features (numpy array): features of reid_boxes
     """
     def __init__(self,config):
         self.config = config
         self.names = config.names
         self.device = select_device(self.config.device)
         self.tracker_model = config.tracker_model
+        self.reid_interval = 1
+        self.reid_frames = 0
+        self.reid_boxes = None
+        self.reid_features = None
         if self.tracker_model == "DEEPSORT":
             self.max_cosine_distance = config.max_cosine_distance
             self.nn_budget = config.nn_budget 
             self.nms_max_overlap = config.nms_max_overlap
-            self.encoder = Encoder(self.device, wt_path=config.tracker_weights_file) 
+            self.encoder = Encoder(self.device, wt_path=config.tracker_weights_file, cache_dir=config.trace_cache_dir if config.trace_cache else None, logger=config.logger)
             self.metric = nn_matching.NearestNeighborDistanceMetric("cosine", self.max_cosine_distance, self.nn_budget)
             self.tracker = Tracker(self.metric,max_iou_distance=self.config.iou_threshold, max_age=self.config.max_age, n_init=self.config.max_hits)
         elif self.tracker_model == "CONVENTIONAL":
@@ -43,7 +58,7 @@ class Track:
         boxes = det[:, :4]
         scores = det[:,4]
         classes = det[:,5]
-        features = self.encoder.getFeatures(frame = frame, out_boxes = boxes)
+        features = self.get_features(frame,boxes)
         boxes[:, 2] = boxes[:,2] - boxes[:,0]
         boxes[:, 3] = boxes[:,3] - boxes[:,1]
         detections = [Detection(bbox, score, class_name, feature) for bbox, score, class_name, feature in zip(boxes, scores, classes, features)]
@@ -65,6 +80,31 @@ class Track:
             objects[object_id] = [self.names[int(class_name)],[bbox[0],bbox[1],bbox[2],bbox[3]]]
         return objects
     
+    def get_features(self,frame,boxes):
+        """deep sort features of the boxes. Between refreshes a box overlapping a box of the previous frame
+        reuses its feature and only the new boxes go through the encoder.
+
+        Args:
+            frame (numpy array): video frame
+            boxes (numpy array): x1, y1, x2, y2 boxes
+
+        Returns:
+            features (numpy array): feature of every box
+        """
+        self.reid_frames += 1
+        refresh = self.reid_interval <= 1 or self.reid_frames % self.reid_interval == 0 or self.reid_boxes is None or not len(self.reid_boxes)
+        if refresh:
+            features = self.encoder.getFeatures(frame = frame, out_boxes = boxes)
+        else:
+            iou = box_iou(torch.from_numpy(np.asarray(boxes, dtype=np.float32)), torch.from_numpy(self.reid_boxes)).numpy()
+            features = self.reid_features[iou.argmax(1)]
+            new = iou.max(1) < REID_IOU
+            if new.any():
+                features[new] = self.encoder.getFeatures(frame = frame, out_boxes = boxes[new])
+        self.reid_boxes = np.array(boxes, dtype=np.float32)
+        self.reid_features = features
+        return features
+
     def sort_tracker(self,dets):
         """Sort Tracker
 
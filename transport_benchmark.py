@@ -0,0 +1,106 @@
+import argparse
+import time
+import numpy as np
+import torch.multiprocessing as mp
+
+from .detect import Detect
+from .frame_ring import FrameRing
+from .data_loader import to_i420
+from .run_vehicle_tracking import put_in_batch_queue
+from .scheduler import BatchScheduler
+from .config_parser import get_config
+from .storage import global_var
+
+def stream(frame_format,frames,count,send_queue,recv_queue,ring,latency):
+    """stream process, sends count frames one at a time like execute_vehicle_tracking and waits for each result
+
+    Args:
+        frame_format (str): BGR or I420
+        frames (list): BGR frames sent in rotation
+        count (int): number of frames to send
+        send_queue (Queue): queue to the detector
+        recv_queue (Queue): queue of the results
+        ring (FrameRing): shared memory ring, None to pickle the frames
+        latency (Value): mean round trip time in seconds, including the conversion to I420
+    """
+    total = 0.0
+    for ind in range(count):
+        t1 = time.time()
+        image = frames[ind % len(frames)]
+        payload = to_i420(image) if frame_format == "I420" else image
+        put_in_batch_queue(payload,send_queue,ring)
+        recv_queue.get()
+        total += time.time() - t1
+    latency.value = total / count
+
+def run(configfile,frame_format,frames,count,inference):
+    """
+    Args:
+        configfile (str): path to config file
+        frame_format (str): BGR or I420
+        frames (list): BGR frames of every stream
+        count (int): number of frames per stream
+        inference (bool): also run the detector, otherwise only the transport and the pre processing are timed
+
+    Returns:
+        fps (float): frames per second over all streams
+        latency (float): mean round trip time of a frame in seconds
+        nbytes (int): bytes per frame sent to the detector
+    """
+    detector = Detect(configfile)
+    config = detector.config
+    config.frame_format = frame_format
+    if inference:
+        detector.warmup()
+    streams = len(config.arms)
+    shape = to_i420(frames[0]).shape if frame_format == "I420" else frames[0].shape
+    rings = [FrameRing(config.ring_slots, shape) if config.shared_memory else None for _ in range(streams)]
+    send_queues = [mp.Queue() for _ in range(streams)]
+    recv_queues = [mp.Queue() for _ in range(streams)]
+    latency = [mp.Value('d', 0.0) for _ in range(streams)]
+    processes = [mp.Process(target=stream, args=(frame_format,frames,count,send_queues[ind],recv_queues[ind],rings[ind],latency[ind])) for ind in range(streams)]
+    for process in processes:
+        process.start()
+    scheduler = BatchScheduler(send_queues,rings,config.max_batch_size,config.max_wait)
+    done = 0
+    t1 = time.time()
+    while done < streams * count:
+        indices,data = scheduler.next_batch()
+        if inference:
+            dets = detector.detect(data)
+        else:
+            detector.pre_process(data)
+            dets = [np.empty((0, 6), dtype=np.float32)] * len(data)
+        for ind,det in zip(indices,dets):
+            recv_queues[ind].put(det)
+        done += len(data)
+    elapsed = time.time() - t1
+    for process in processes:
+        process.join()
+    for ring in rings:
+        if ring is not None:
+            ring.close()
+    return streams * count / elapsed, float(np.mean([value.value for value in latency])), int(np.prod(shape))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares BGR and I420 frame transport between the stream processes and the detector")
+    parser.add_argument('--config', default="configfile.ini", help="path to config file")
+    parser.add_argument('--frames', type=int, default=200, help="number of frames per stream")
+    parser.add_argument('--inference', action='store_true', help="include the detector, by default only transport and pre processing are timed")
+    opt = parser.parse_args()
+    mp.set_start_method('spawn')
+    config = get_config(global_var,opt.config)
+    size = config.img_size
+    frames = [np.random.randint(0, 255, (size, size, 3), dtype=np.uint8) for _ in range(4)]
+    results = {}
+    print("%-6s %14s %12s %14s" % ("format", "bytes/frame", "frames/s", "latency(ms)"))
+    for frame_format in ("BGR", "I420"):
+        fps,latency,nbytes = run(opt.config,frame_format,frames,opt.frames,opt.inference)
+        results[frame_format] = fps,latency
+        print("%-6s %14d %12.1f %14.2f" % (frame_format, nbytes, fps, latency * 1000))
+    (bgr_fps,bgr_latency),(i420_fps,i420_latency) = results["BGR"],results["I420"]
+    print("I420: %+.1f%% frames/s, %+.1f%% latency, %d streams, %s" % (100 * (i420_fps / bgr_fps - 1), 100 * (i420_latency / bgr_latency - 1),
+          len(config.arms), "shared memory" if config.shared_memory else "pickled frames"))
+
+if __name__ == '__main__':
+    main()
@@ -811,7 +811,9 @@ def non_max_suppression(prediction,
                         agnostic=False,
                         multi_label=False,
                         labels=(),
-                        max_det=300):
+                        max_det=300,
+                        max_nms=30000,
+                        batched=False):
     """Non-Maximum Suppression (NMS) on inference results to reject overlapping bounding boxes
 
     Returns:
@@ -826,10 +828,14 @@ def non_max_suppression(prediction,
     assert 0 <= conf_thres <= 1, f'Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0'
     assert 0 <= iou_thres <= 1, f'Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0'
 
+    if batched:  # one NMS call for the whole batch, no per-image loop or time limit
+        assert not labels and not multi_label, 'labels and multi_label are not supported by batched NMS'
+        x = batched_non_max_suppression(prediction, conf_thres, iou_thres, classes, agnostic, max_det, max_nms)
+        return list(x[:, :6].split(torch.bincount(x[:, 6].long(), minlength=bs).tolist()))
+
     # Settings
     # min_wh = 2  # (pixels) minimum box width and height
     max_wh = 7680  # (pixels) maximum box width and height
-    max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
     time_limit = 0.3 + 0.03 * bs  # seconds to quit after
     redundant = True  # require redundant detections
     multi_label &= nc > 1  # multiple labels per box (adds 0.5ms/img)
@@ -906,6 +912,56 @@ def non_max_suppression(prediction,
     return output
 
 
+def batched_non_max_suppression(prediction,
+                                conf_thres=0.25,
+                                iou_thres=0.45,
+                                classes=None,
+                                agnostic=False,
+                                max_det=300,
+                                max_nms=30000):
+    """Non-Maximum Suppression (NMS) over all images of a batch with a single torchvision.ops.nms() call
+
+    Boxes are offset by class along x and by image along y so boxes of different images or classes never overlap.
+    The top max_nms candidates of every image are selected on-device before NMS and no image is ever dropped.
+
+    Returns:
+         (n,7) tensor of detections [xyxy, conf, cls, image_index], grouped by image and sorted by confidence
+    """
+
+    bs = prediction.shape[0]  # batch size
+    max_wh = 7680  # (pixels) maximum box width and height
+
+    # Candidates across the whole batch
+    b, k = (prediction[..., 4] > conf_thres).nonzero(as_tuple=True)  # image index, box index
+    x = prediction[b, k]
+
+    # Compute conf
+    conf, j = (x[:, 5:] * x[:, 4:5]).max(1)  # conf = obj_conf * cls_conf, best class only
+    keep = conf > conf_thres
+    if classes is not None:  # filter by class
+        keep &= (j[:, None] == torch.tensor(classes, device=j.device)).any(1)
+    b, x, conf, j = b[keep], x[keep], conf[keep], j[keep].float()
+
+    # Pre-NMS top-k per image
+    i = (b + 1 - conf).argsort()  # conf in (0, 1] so image index dominates the sort key
+    b, x, conf, j = b[i], x[i], conf[i], j[i]
+    i = _rank_in_image(b, bs) < max_nms
+    b, box, conf, j = b[i], xywh2xyxy(x[i, :4]), conf[i], j[i]  # (center x, center y, width, height) to xyxy
+
+    # Batched NMS
+    offset = torch.stack((j * (0 if agnostic else max_wh), b.float() * max_wh), 1).repeat(1, 2)  # class x, image y
+    i = torchvision.ops.nms(box + offset, conf, iou_thres)  # NMS
+    i = i.sort()[0]  # back to image then confidence order
+    i = i[_rank_in_image(b[i], bs) < max_det]  # limit detections
+    return torch.cat((box[i], conf[i, None], j[i, None], b[i, None].float()), 1)
+
+
+def _rank_in_image(b, bs):
+    # Position of every detection within its image, b is the image index of each detection sorted by image
+    counts = torch.bincount(b, minlength=bs)
+    return torch.arange(len(b), device=b.device) - (counts.cumsum(0) - counts)[b]
+
+
 def strip_optimizer(f='best.pt', s=''):  # from utils.general import *; strip_optimizer()
     # Strip optimizer from 'f' to finalize training, optionally save as 's'
     x = torch.load(f, map_location=torch.device('cpu'))